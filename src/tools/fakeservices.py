@@ -0,0 +1,467 @@
+###########################################################################
+#  fakeservices - local stand-ins for the services vintel calls			  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+"""
+A local stand-in for the services vintel calls: the EVE API, evegate
+profiles, the character images, the CVA KOS api, the dotlan maps and the
+files on S3. The answers are synthetic (or recorded files) and every one can
+be slowed down, made to fail or made bigger, so the network paths can be run
+and measured on an offline machine.
+Run it from the src directory:
+    python tools/fakeservices.py [--port 8080] [--latency 0.2] [--error-rate 0.05] ...
+It prints the base url; patchModules(baseUrl) points evegate, koschecker,
+dotlan and amazon_s3 at it and useCache(path) gives the cache a database of
+its own, so the answers do not end up in the real one. For pytest the
+fakeServices fixture does all of it with a fresh cache per test, import it
+into the test module (see tools/test_fakeservices.py).
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+
+from xml.sax.saxutils import escape, quoteattr
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, unquote, urlparse
+
+sys.path.insert(0, os.path.abspath("."))
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+SVG_PATH = "vi/ui/res/mapdata/Providencecatch.svg"
+
+# The corporation everybody starts in, evegate.NPC_CORPS knows its name
+NPC_CORP_ID = 1000166
+NPC_CORP_NAME = u"Imperial Academy"
+
+XML_HEAD = u"<?xml version='1.0' encoding='UTF-8'?>\n<eveapi version=\"2\"><currentTime>{now}</currentTime><result>"
+XML_TAIL = u"</result><cachedUntil>{until}</cachedUntil></eveapi>"
+
+
+class Settings(object):
+    """ The knobs of the fake services
+        latency, jitter: seconds every answer is delayed, plus up to jitter at random
+        errorRate: part of the requests answered with 503
+        systems: number of solarsystems in the statistics
+        svgSize: the map is padded to at least this many bytes
+        avatarSize: bytes of one avatar
+        kosRate: part of the pilots and corporations CVA calls KOS
+        jumpbridges: number of bridges in the S3 lists
+        cacheSeconds: cachedUntil of the EVE API answers
+        recordings: directory with recorded answers, a file named like the last
+                    part of the path (e.g. Jumps.xml.aspx) is served as it is
+        seed: for the random numbers, same seed same answers
+    """
+
+    def __init__(self, **kwargs):
+        self.latency = 0.0
+        self.jitter = 0.0
+        self.errorRate = 0.0
+        self.systems = 5000
+        self.svgSize = 0
+        self.avatarSize = 1500
+        self.kosRate = 0.2
+        self.jumpbridges = 10
+        self.cacheSeconds = 60 * 60
+        self.recordings = None
+        self.seed = 242
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise TypeError("unknown setting {0}".format(key))
+            setattr(self, key, value)
+
+
+def charIdOf(name):
+    return 90000000 + zlib.crc32(name.encode("utf-8")) % 9000000
+
+
+def corpIdsOf(charId):
+    """ The employment history of a pilot, newest first
+    """
+    return [98000000 + charId % 1000, NPC_CORP_ID]
+
+
+def isKos(name, rate):
+    return zlib.crc32(name.encode("utf-8")) % 1000 < rate * 1000
+
+
+def loadMapSystems(path=SVG_PATH):
+    """ The svg of the bundled map and its systems as (id, name)
+    """
+    with io.open(path, encoding="utf-8") as svgFile:
+        svg = svgFile.read()
+    systems = re.findall(r'id="def(\d+)".*?class="ss"[^>]*>([^<]+)</text>', svg, re.DOTALL)
+    return svg, [(int(systemId), name.strip()) for systemId, name in systems]
+
+
+class FakeServices(object):
+    """ The server, started in a daemon thread. requests counts the requests per path
+    """
+
+    def __init__(self, settings=None, port=0):
+        self.settings = settings or Settings()
+        self.random = random.Random(self.settings.seed)
+        self.svg, self.mapSystems = loadMapSystems()
+        self.names = {}
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.server = _Server(("127.0.0.1", port), _Handler)
+        self.server.services = self
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{0}".format(self.server.server_address[1])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="FakeServices")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def roll(self):
+        with self.lock:
+            return self.random.random()
+
+    def delay(self):
+        settings = self.settings
+        wait = settings.latency + (self.roll() * settings.jitter if settings.jitter else 0)
+        if wait > 0:
+            time.sleep(wait)
+
+    def answer(self, path, query):
+        """ Returns (status, content type, body) for a request
+        """
+        last = path.rstrip("/").rsplit("/", 1)[-1]
+        recordings = self.settings.recordings
+        if recordings and last and os.path.isfile(os.path.join(recordings, last)):
+            with open(os.path.join(recordings, last), "rb") as f:
+                return 200, "application/octet-stream", f.read()
+        for pattern, method in ROUTES:
+            match = re.match(pattern, path)
+            if match:
+                return method(self, query, *match.groups())
+        return 404, "text/plain", b"not found"
+
+    def xml(self, rows):
+        # the answers stay the same until cachedUntil, so they can be revalidated
+        seconds = max(self.settings.cacheSeconds, 1)
+        start = time.time() // seconds * seconds
+        now = datetime.datetime.utcfromtimestamp(start)
+        until = datetime.datetime.utcfromtimestamp(start + seconds)
+        text = XML_HEAD.format(now=now.strftime("%Y-%m-%d %H:%M:%S")) + rows + \
+               XML_TAIL.format(until=until.strftime("%Y-%m-%d %H:%M:%S"))
+        return 200, "text/xml; charset=utf-8", text.encode("utf-8")
+
+    def nameOf(self, entityId):
+        if entityId == NPC_CORP_ID:
+            return NPC_CORP_NAME
+        if 98000000 <= entityId < 99000000:
+            return u"Corporation {0}".format(entityId)
+        with self.lock:
+            return self.names.get(entityId, u"Pilot {0}".format(entityId))
+
+    def characterIds(self, query):
+        names = [name for name in query.get("names", [""])[0].split(",") if name]
+        rows = []
+        for name in names:
+            charId = charIdOf(name)
+            with self.lock:
+                self.names[charId] = name
+            rows.append(u"<row name={0} characterID=\"{1}\" />".format(quoteattr(name), charId))
+        return self.xml(u"<rowset name=\"characters\" key=\"characterID\" columns=\"name,characterID\">"
+                        + u"".join(rows) + u"</rowset>")
+
+    def characterNames(self, query):
+        ids = [int(entityId) for entityId in query.get("ids", [""])[0].split(",") if entityId]
+        rows = [u"<row name={0} characterID=\"{1}\" />".format(quoteattr(self.nameOf(entityId)), entityId)
+                for entityId in ids]
+        return self.xml(u"<rowset name=\"characters\" key=\"characterID\" columns=\"name,characterID\">"
+                        + u"".join(rows) + u"</rowset>")
+
+    def characterInfo(self, query):
+        charId = int(query.get("characterID", ["0"])[0])
+        rows = [u"<row recordID=\"{0}\" corporationID=\"{1}\" startDate=\"2014-01-01 00:00:00\" />".format(number, corpId)
+                for number, corpId in enumerate(corpIdsOf(charId))]
+        return self.xml(u"<characterID>{0}</characterID><characterName>{1}</characterName>".format(
+                        charId, escape(self.nameOf(charId)))
+                        + u"<rowset name=\"employmentHistory\" key=\"recordID\" columns=\"recordID,corporationID,startDate\">"
+                        + u"".join(rows) + u"</rowset>")
+
+    def periodRandom(self):
+        """ Random numbers which stay the same for cacheSeconds, like the statistics of the API
+        """
+        return random.Random(self.settings.seed + int(time.time() // max(self.settings.cacheSeconds, 1)))
+
+    def statisticIds(self):
+        ids = [systemId for systemId, name in self.mapSystems]
+        known = set(ids)
+        systemId = 30000001
+        while len(ids) < self.settings.systems:
+            if systemId not in known:
+                ids.append(systemId)
+            systemId += 1
+        return ids[:max(self.settings.systems, len(self.mapSystems))]
+
+    def jumps(self, query):
+        numbers = self.periodRandom()
+        rows = [u"<row solarSystemID=\"{0}\" shipJumps=\"{1}\" />".format(systemId, numbers.randint(0, 200))
+                for systemId in self.statisticIds()]
+        return self.xml(u"<rowset name=\"solarSystems\" key=\"solarSystemID\" columns=\"solarSystemID,shipJumps\">"
+                        + u"\n".join(rows) + u"</rowset>")
+
+    def kills(self, query):
+        numbers = self.periodRandom()
+        rows = [u"<row solarSystemID=\"{0}\" shipKills=\"{1}\" factionKills=\"{2}\" podKills=\"{3}\" />".format(
+                systemId, numbers.randint(0, 10), numbers.randint(0, 50), numbers.randint(0, 5))
+                for systemId in self.statisticIds()]
+        return self.xml(u"<rowset name=\"solarSystems\" key=\"solarSystemID\" "
+                        u"columns=\"solarSystemID,shipKills,factionKills,podKills\">"
+                        + u"\n".join(rows) + u"</rowset>")
+
+    def profile(self, query, name):
+        name = unquote(name)
+        html = u"<html><body><img id=\"imgActiveCharacter\" src=\"http://image.eveonline.com/Character/{0}_256.jpg\" />" \
+               u"<h1>{1}</h1></body></html>".format(charIdOf(name), escape(name))
+        return 200, "text/html; charset=utf-8", html.encode("utf-8")
+
+    def avatar(self, query, charId, size):
+        # jpeg markers around some bytes, different per pilot
+        seed = hashlib.sha1(charId.encode("ascii")).digest()
+        length = max(self.settings.avatarSize - 6, 0)
+        body = (seed * (length // len(seed) + 1))[:length]
+        return 200, "image/jpeg", b"\xff\xd8\xff\xe0" + body + b"\xff\xd9"
+
+    def kos(self, query):
+        kind = query.get("type", ["multi"])[0]
+        names = [name for name in query.get("q", [""])[0].split(",") if name]
+        rate = self.settings.kosRate
+        results = []
+        for name in names:
+            if kind == "unit":
+                results.append({"label": name, "type": "corp", "kos": isKos(name, rate),
+                                "alliance": {"label": u"Alliance of " + name, "kos": False}})
+            elif charIdOf(name) % 3:
+                # a third of the pilots is unknown to CVA
+                corpName = u"Corporation {0}".format(corpIdsOf(charIdOf(name))[0])
+                results.append({"label": name, "type": "pilot", "kos": isKos(name, rate),
+                                "corp": {"label": corpName, "kos": isKos(corpName, rate),
+                                         "alliance": {"label": u"Alliance of " + corpName, "kos": False}}})
+        return 200, "application/json", json.dumps({"total": len(results), "results": results}).encode("utf-8")
+
+    def map(self, query, region):
+        svg = self.svg
+        if len(svg) < self.settings.svgSize:
+            svg += u"\n<!-- {0} -->".format(u"x" * (self.settings.svgSize - len(svg)))
+        return 200, "image/svg+xml", svg.encode("utf-8")
+
+    def jumpbridgeList(self, query, region):
+        names = [name for systemId, name in self.mapSystems]
+        lines = [u"{0} <-> {1}".format(names[2 * i], names[2 * i + 1])
+                 for i in range(min(self.settings.jumpbridges, len(names) // 2))]
+        return 200, "text/plain", u"\n".join(lines).encode("utf-8")
+
+    def version(self, query):
+        return 200, "text/plain", b"0.0"
+
+
+ROUTES = ((r"^/eve/CharacterID\.xml\.aspx$", FakeServices.characterIds),
+          (r"^/eve/CharacterName\.xml\.aspx$", FakeServices.characterNames),
+          (r"^/eve/CharacterInfo\.xml\.aspx$", FakeServices.characterInfo),
+          (r"^/map/Jumps\.xml\.aspx$", FakeServices.jumps),
+          (r"^/map/Kills\.xml\.aspx$", FakeServices.kills),
+          (r"^/Profile/(.+)$", FakeServices.profile),
+          (r"^/Character/(\d+)_(\d+)\.jpg$", FakeServices.avatar),
+          (r"^/kos/api/?$", FakeServices.kos),
+          (r"^/svg/(.+)\.svg$", FakeServices.map),
+          (r"^/s3/(.+)_jb\.txt$", FakeServices.jumpbridgeList),
+          (r"^/s3/current-version\.txt$", FakeServices.version))
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        services = self.server.services
+        parsed = urlparse(self.path)
+        services.count(parsed.path)
+        services.delay()
+        if services.roll() < services.settings.errorRate:
+            self.send(503, "text/plain", b"fake error")
+            return
+        try:
+            status, contentType, body = services.answer(parsed.path, parse_qs(parsed.query))
+        except Exception as e:
+            self.send(500, "text/plain", str(e).encode("utf-8"))
+            return
+        etag = '"{0}"'.format(hashlib.md5(body).hexdigest())
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.send(304, contentType, b"", etag)
+        else:
+            self.send(status, contentType, body, etag)
+
+    def send(self, status, contentType, body, etag=None):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def patchModules(baseUrl, rateLimit=None):
+    """ Points the url constants of the modules at baseUrl. rateLimit, (rate, burst),
+        replaces the limit of vi.httpclient for the fake host.
+        Returns what restoreModules needs to undo it
+    """
+    from vi import dotlan, evegate, httpclient, koschecker
+    try:
+        from vi import amazon_s3
+    except ImportError:
+        # amazon_s3 needs PyQt4, without it only the other services are faked
+        amazon_s3 = None
+    changes = ((evegate, "CHARACTER_ID_URL", baseUrl + "/eve/CharacterID.xml.aspx"),
+               (evegate, "CHARACTER_NAME_URL", baseUrl + "/eve/CharacterName.xml.aspx"),
+               (evegate, "CHARACTER_INFO_URL", baseUrl + "/eve/CharacterInfo.xml.aspx"),
+               (evegate, "JUMPS_URL", baseUrl + "/map/Jumps.xml.aspx"),
+               (evegate, "KILLS_URL", baseUrl + "/map/Kills.xml.aspx"),
+               (evegate, "PROFILE_URL", baseUrl + "/Profile/"),
+               (evegate, "AVATAR_URL", baseUrl + "/Character/{id}_{size}.jpg"),
+               (koschecker, "CVA_KOS_URL", baseUrl + "/kos/api/"),
+               (dotlan.Map, "DOTLAN_BASIC_URL", baseUrl + "/svg/{0}.svg"))
+    if amazon_s3 is not None:
+        changes += ((amazon_s3, "JUMPBRIDGE_URL", baseUrl + "/s3/{region}_jb.txt"),
+                    (amazon_s3, "VERSION_URL", baseUrl + "/s3/current-version.txt"))
+    if rateLimit is not None:
+        limits = dict(httpclient.RATE_LIMITS)
+        limits[httpclient.hostOf(baseUrl)] = rateLimit
+        changes += ((httpclient, "RATE_LIMITS", limits),)
+    originals = []
+    for target, name, value in changes:
+        originals.append((target, name, getattr(target, name)))
+        setattr(target, name, value)
+    return originals
+
+
+def useCache(path):
+    """ Makes every Cache use the database at path, with an empty memory tier.
+        Returns what restoreCache needs to undo it
+    """
+    from vi.cache.cache import Cache
+    from vi.cache.memorycache import MemoryCache
+    # what is waiting for the old database is written there first
+    Cache.WRITE_BEHIND.flush()
+    changes = ((Cache, "PATH_TO_CACHE", path),
+               (Cache, "VERSION_CHECKED", False),
+               (Cache, "MEMORY", MemoryCache()))
+    originals = []
+    for target, name, value in changes:
+        originals.append((target, name, getattr(target, name)))
+        setattr(target, name, value)
+    return originals
+
+
+def restoreModules(originals):
+    for target, name, value in originals:
+        setattr(target, name, value)
+
+
+def restoreCache(originals):
+    from vi.cache.cache import Cache
+    Cache.WRITE_BEHIND.flush()
+    restoreModules(originals)
+
+
+if pytest is not None:
+    @pytest.fixture
+    def fakeServices(tmpdir):
+        """ A running FakeServices with the modules pointed at it and a fresh cache
+            database; change fakeServices.settings in the test to slow it down or break it
+        """
+        services = FakeServices().start()
+        originals = patchModules(services.url, rateLimit=(1000.0, 1000))
+        cacheOriginals = useCache(str(tmpdir.join("fakeservices.sqlite3")))
+        try:
+            yield services
+        finally:
+            restoreCache(cacheOriginals)
+            restoreModules(originals)
+            services.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-ins for the services vintel calls")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--systems", type=int, default=5000)
+    parser.add_argument("--svg-size", type=int, default=0)
+    parser.add_argument("--avatar-size", type=int, default=1500)
+    parser.add_argument("--kos-rate", type=float, default=0.2)
+    parser.add_argument("--recordings", default=None)
+    args = parser.parse_args()
+    settings = Settings(latency=args.latency, jitter=args.jitter, errorRate=args.error_rate, systems=args.systems,
+                        svgSize=args.svg_size, avatarSize=args.avatar_size, kosRate=args.kos_rate,
+                        recordings=args.recordings)
+    services = FakeServices(settings, args.port).start()
+    print("Serving on {0}, patchModules(\"{0}\") points vintel at it. Ctrl-C ends".format(services.url))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        services.stop()
+
+
+if __name__ == "__main__":
+    main()
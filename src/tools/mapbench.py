@@ -0,0 +1,105 @@
+###########################################################################
+#  mapbench - compares the frame cost of the map renderers				  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+"""
+Measures what one map update costs with the QWebView (serialize the soup,
+setContent, wait for the page) and with the native QGraphicsScene renderer
+(update the items, repaint the viewport).
+Run it from the src directory:
+    python tools/mapbench.py [region] [frames]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import random
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath("."))
+
+from PyQt4 import QtGui, QtCore
+from PyQt4.QtWebKit import QWebView
+
+from vi import dotlan, states
+from vi.cache.cache import Cache
+from vi.resources import resourcePath
+from vi.ui.maprenderer import MapGraphicsView, SceneMapRenderer
+
+
+def loadMap(region):
+    with open(resourcePath("vi/ui/res/mapdata/{0}.svg".format(region))) as svgFile:
+        return dotlan.Map(region, svgFile.read())
+
+
+def stirMap(dotlanMap, count=10):
+    """ Changes a few systems like incoming intel would do
+    """
+    systems = random.sample(list(dotlanMap.systems.values()), min(count, len(dotlanMap.systems)))
+    for system in systems:
+        system.setStatus(random.choice((states.ALARM, states.CLEAR)))
+    systems[0].mark()
+
+
+def benchWebView(app, dotlanMap, frames):
+    view = QWebView()
+    view.resize(1050, 790)
+    view.show()
+    loop = QtCore.QEventLoop()
+    view.connect(view, QtCore.SIGNAL("loadFinished(bool)"), loop.quit)
+    started = time.time()
+    for _ in range(frames):
+        stirMap(dotlanMap)
+        view.setContent(dotlanMap.svg)
+        loop.exec_()
+        app.processEvents()
+    return (time.time() - started) / frames
+
+
+def benchScene(app, dotlanMap, frames):
+    renderer = SceneMapRenderer(dotlanMap)
+    view = MapGraphicsView()
+    view.setRenderer(renderer)
+    view.resize(1050, 790)
+    view.show()
+    app.processEvents()
+    started = time.time()
+    for _ in range(frames):
+        stirMap(dotlanMap)
+        renderer.update()
+        view.viewport().repaint()
+        app.processEvents()
+    return (time.time() - started) / frames
+
+
+def main():
+    region = sys.argv[1] if len(sys.argv) > 1 else "Providencecatch"
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    Cache.PATH_TO_CACHE = os.path.join(tempfile.mkdtemp(), "mapbench.sqlite3")
+    app = QtGui.QApplication(sys.argv)
+    webkitFrame = benchWebView(app, loadMap(region), frames)
+    sceneFrame = benchScene(app, loadMap(region), frames)
+    print("{0}: {1} frames".format(region, frames))
+    print("QWebView:         {0:8.2f} ms/frame".format(webkitFrame * 1000))
+    print("QGraphicsScene:   {0:8.2f} ms/frame".format(sceneFrame * 1000))
+
+
+if __name__ == "__main__":
+    main()
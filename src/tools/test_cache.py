@@ -0,0 +1,150 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+"""
+Checks the write behind queue of vi.cache and how it keeps up with the direct
+writes. Run it from the src directory:
+    python -m pytest tools
+"""
+
+import threading
+
+import pytest
+
+from fakeservices import restoreCache, useCache
+from vi.cache.cache import Cache
+from vi.cache.memorycache import MISSING
+from vi.cache.writebehind import WriteBehindQueue
+
+
+@pytest.fixture
+def cache(tmpdir):
+    originals = useCache(str(tmpdir.join("cache.sqlite3")))
+    try:
+        yield Cache()
+    finally:
+        restoreCache(originals)
+
+
+def writeBehind(writer):
+    queue = WriteBehindQueue(writer)
+    # only the flushes of the test write
+    queue.FLUSH_INTERVAL = 60
+    return queue
+
+
+def testCoalescing():
+    written = []
+    queue = writeBehind(lambda path, rows: written.append((path, rows)))
+    for value in ("a", "b", "c"):
+        queue.put("db", "key", value, 60)
+    queue.put("db", "other", "x", 60, "etag")
+    assert queue.get("db", "key") == "c"
+    queue.flush()
+    assert len(written) == 1
+    assert sorted(written[0][1]) == [("key", "c", 60, None, None), ("other", "x", 60, "etag", None)]
+    assert queue.get("db", "key") is MISSING
+
+
+def testOutdatedIsNotRead():
+    queue = writeBehind(lambda path, rows: None)
+    queue.put("db", "key", "value", 0)
+    assert queue.get("db", "key") is None
+    assert queue.get("db", "key", outdated=True) == "value"
+
+
+def testFlushAfterFailedWrite():
+    written = []
+
+    def writer(path, rows):
+        if not written:
+            written.append(None)
+            # a newer value arrives while the batch is written
+            queue.put(path, "key", "newer", 60)
+            raise IOError("disk full")
+        written.append(rows)
+
+    queue = writeBehind(writer)
+    queue.put("db", "key", "old", 60)
+    queue.put("db", "other", "kept", 60)
+    with pytest.raises(IOError):
+        queue.flush()
+    assert queue.get("db", "key") == "newer"
+    assert queue.get("db", "other") == "kept"
+    queue.flush()
+    assert sorted(written[1]) == [("key", "newer", 60, None, None), ("other", "kept", 60, None, None)]
+
+
+def testTakeWaitsForTheBatchBeingWritten():
+    writing = threading.Event()
+    release = threading.Event()
+
+    def writer(path, rows):
+        writing.set()
+        release.wait(5)
+
+    queue = writeBehind(writer)
+    queue.put("db", "key", "old", 60)
+    flusher = threading.Thread(target=queue.flush)
+    flusher.start()
+    assert writing.wait(5)
+    taker = threading.Thread(target=queue.take, args=("db", ("key",)))
+    taker.start()
+    taker.join(0.2)
+    assert taker.is_alive()
+    release.set()
+    flusher.join(5)
+    taker.join(5)
+    assert not taker.is_alive()
+
+
+def testDirectWriteReplacesDeferred(cache):
+    cache.putIntoCacheDeferred("key", "old")
+    cache.putIntoCache("key", "new")
+    assert cache.getFromCache("key") == "new"
+    cache.flush()
+    Cache.MEMORY.clear()
+    assert cache.getFromCache("key") == "new"
+
+
+def testPutManyReplacesDeferred(cache):
+    cache.putIntoCacheDeferred("key", "old")
+    cache.putMany({"key": "new", "other": "x"})
+    assert cache.getMany(("key", "other")) == {"key": "new", "other": "x"}
+    cache.flush()
+    Cache.MEMORY.clear()
+    assert cache.getMany(("key", "other")) == {"key": "new", "other": "x"}
+
+
+def testExtendWritesDeferred(cache):
+    cache.putIntoCacheDeferred("key", "value", 0, etag="etag")
+    assert cache.getFromCache("key") is None
+    assert cache.extend("key", 60)
+    assert Cache.WRITE_BEHIND.get(cache.pathToSQLiteFile, "key") is MISSING
+    assert cache.getFromCache("key") == "value"
+    assert cache.getValidators("key") == ("etag", None)
+
+
+def testOutdatedDeferredHidesOlderValue(cache):
+    cache.putIntoCache("key", "old", 60)
+    cache.putIntoCacheDeferred("key", "new", 0)
+    assert cache.getFromCache("key") is None
+    assert cache.getMany(("key",)) == {}
+    assert cache.getFromCache("key", True) == "new"
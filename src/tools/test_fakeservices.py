@@ -0,0 +1,71 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+"""
+Runs the network paths against tools/fakeservices.py instead of the real
+services. Run it from the src directory:
+    python -m pytest tools
+"""
+
+import pytest
+
+from fakeservices import charIdOf, fakeServices
+from vi import evegate, koschecker
+
+
+def testNamesAndIds(fakeServices):
+    names = [u"Aura Pilot", u"Some Other Pilot"]
+    ids = evegate.namesToIds(names)
+    assert ids == dict((name, str(charIdOf(name))) for name in names)
+    assert evegate.idsToNames([ids[name] for name in names]) == dict((ids[name], name) for name in names)
+    # the second time everything comes from the cache
+    requests = dict(fakeServices.requests)
+    assert evegate.namesToIds(names) == ids
+    assert fakeServices.requests == requests
+
+
+def testSystemStatistics(fakeServices):
+    fakeServices.settings.systems = 1000
+    statistics = evegate.getSystemStatistics([30003758, 1])
+    assert list(statistics) == [30003758]
+    assert set(statistics[30003758]) == set(("jumps", "shipkills", "factionkills", "podkills"))
+
+
+def testKosCheck(fakeServices):
+    names = [u"Aura Pilot", u"Some Other Pilot", u"Third Pilot"]
+    result = koschecker.check(names)
+    assert set(result) == set(names)
+    assert all(entry["kos"] in (koschecker.KOS, koschecker.NOT_KOS, koschecker.RED_BY_LAST, koschecker.UNKNOWN)
+               for entry in result.values())
+
+
+def testCustomJumpbridgesRevalidated(fakeServices):
+    amazon_s3 = pytest.importorskip("vi.amazon_s3")
+    url = fakeServices.url + "/s3/custom_jb.txt"
+    first = amazon_s3.fetchJumpbridgeData(url, "jb_url_" + url, 0)
+    # maxAge 0: asked again, the answer is a 304 and the cached list is used
+    second = amazon_s3.fetchJumpbridgeData(url, "jb_url_" + url, 0)
+    assert first and second == first
+    assert fakeServices.requests["/s3/custom_jb.txt"] == 2
+
+
+def testErrorsAreSurvived(fakeServices):
+    fakeServices.settings.errorRate = 1.0
+    assert evegate.namesToIds([u"Nobody Answers"]) == {}
@@ -0,0 +1,69 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+"""
+Checks the rate limits and priorities of vi.httpclient. Run it from the src directory:
+    python -m pytest tools
+"""
+
+import threading
+import time
+
+from fakeservices import fakeServices
+from vi import evegate, httpclient
+
+
+def testInteractiveGetsTheNextSlot():
+    slots = httpclient.HostSlots(1)
+    slots.acquire()
+    order = []
+
+    def request(priority):
+        with slots.held(priority):
+            order.append(priority)
+
+    background = threading.Thread(target=request, args=(httpclient.BACKGROUND,))
+    background.start()
+    while not slots._waiting[httpclient.BACKGROUND]:
+        time.sleep(0.01)
+    interactive = threading.Thread(target=request, args=(httpclient.INTERACTIVE,))
+    interactive.start()
+    while not slots._waiting[httpclient.INTERACTIVE]:
+        time.sleep(0.01)
+    slots.release()
+    background.join(5)
+    interactive.join(5)
+    assert order == [httpclient.INTERACTIVE, httpclient.BACKGROUND]
+
+
+def testRetriesTakeTokens(fakeServices):
+    fakeServices.settings.errorRate = 1.0
+    url = evegate.CHARACTER_ID_URL
+    bucket = httpclient.client()._bucket(httpclient.hostOf(url))
+    acquired = []
+    acquire = bucket.acquire
+    bucket.acquire = lambda priority=httpclient.BACKGROUND: acquired.append(priority) or acquire(priority)
+    try:
+        with httpclient.interactive():
+            response = httpclient.get(url, params={"names": "Nobody"})
+    finally:
+        del bucket.acquire
+    assert response.status_code == 503
+    assert acquired == [httpclient.INTERACTIVE] * (httpclient.RETRIES + 1)
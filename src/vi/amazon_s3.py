@@ -17,44 +17,56 @@
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
-import json
-import requests
 import logging
 
 from PyQt4 import Qt
 from PyQt4.QtCore import QThread
+from vi import httpclient
 from vi import version
 from vi.cache.cache import Cache
 from distutils.version import LooseVersion, StrictVersion
 
+JUMPBRIDGE_URL = "https://s3.amazonaws.com/vintel-resources/{region}_jb.txt"
+VERSION_URL = "https://s3.amazonaws.com/vintel-resources/current-version.txt"
+
+JUMPBRIDGE_MAX_AGE = 60 * 60 * 12
+
 
 def getJumpbridgeData(region):
     try:
-        cacheKey = "jb_" + region
-        cache = Cache()
-        data = cache.getFromCache(cacheKey)
-
-        if data:
-            data = json.loads(data)
-        else:
-            data = []
-            url = "https://s3.amazonaws.com/vintel-resources/{region}_jb.txt"
-            resp = requests.get(url.format(region=region))
-            for line in resp.iter_lines(decode_unicode=True):
-                splits = line.strip().split()
-                if len(splits) == 3:
-                    data.append(splits)
-            cache.putIntoCache(cacheKey, json.dumps(data), 60 * 60 * 12)
-        return data
+        return fetchJumpbridgeData(JUMPBRIDGE_URL.format(region=region), "jb_" + region, JUMPBRIDGE_MAX_AGE)
     except Exception as e:
         logging.error("Getting Jumpbridgedata failed with: %s", e)
         return []
 
 
+def fetchJumpbridgeData(url, cacheKey, maxAge):
+    """ The jumpbridges listed at url, a list of [sys1, connection, sys2].
+        Kept in the cache for maxAge seconds, after that a conditional request
+        asks if the list changed. Raises the exception if the download fails.
+        Called from the UI thread, so the cache writes are deferred
+    """
+    cache = Cache()
+    data = cache.getValue(cacheKey)
+    if data is None:
+        resp = httpclient.refresh(url, cache, cacheKey, maxAge, deferred=True)
+        if resp is None:
+            # unchanged; with a maxAge of 0 the entry is outdated at once
+            return cache.getValue(cacheKey, True)
+        resp.raise_for_status()
+        data = []
+        for line in resp.iter_lines(decode_unicode=True):
+            splits = line.strip().split()
+            if len(splits) == 3:
+                data.append(splits)
+        etag, lastModified = httpclient.validatorsOf(resp)
+        cache.putValueDeferred(cacheKey, data, maxAge, etag, lastModified)
+    return data
+
+
 def getNewestVersion():
     try:
-        url = "https://s3.amazonaws.com/vintel-resources/current-version.txt"
-        newestVersion = requests.get(url).text
+        newestVersion = httpclient.get(VERSION_URL).text
         return newestVersion
     except Exception as e:
         logging.error("Failed version-request: %s", e)
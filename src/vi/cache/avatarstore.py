@@ -0,0 +1,159 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+class AvatarStore(object):
+    """
+        Keeps the avatars of the players in the cache database. Identical pictures
+        (like the default portrait) are stored once, keyed by their sha1. The
+        store stays below MAX_BYTES, the avatars not shown for the longest time
+        are dropped first.
+        cache = the Cache whose connection and write lock are used
+    """
+
+    # Byte budget for all stored pictures
+    MAX_BYTES = 16 * 1024 * 1024
+
+    # The access time of an avatar is only written again after this many seconds
+    ACCESS_RESOLUTION = 60 * 60
+
+    # Names dropped per statement while evicting
+    EVICT_BATCH_SIZE = 100
+
+    # Bytes stored per database file, kept up to date by the writes so a put needs no SUM over all pictures
+    _sizes = {}
+
+    def __init__(self, cache, writeLock=None):
+        self.cache = cache
+        self.writeLock = writeLock or threading.Lock()
+
+    @property
+    def con(self):
+        return self.cache.con
+
+    def putAvatar(self, name, data):
+        """ Stores the picture for the player name
+        """
+        data = bytes(data)
+        digest = hashlib.sha1(data).hexdigest()
+        now = time.time()
+        with self.writeLock:
+            size = self.size()
+            old = self.con.execute("SELECT hash FROM avatarnames WHERE charname = ?", (name,)).fetchone()
+            added = self.con.execute("INSERT OR IGNORE INTO avatarblobs (hash, data, size) VALUES (?, ?, ?)",
+                                     (digest, sqlite3.Binary(data), len(data))).rowcount
+            self.con.execute("INSERT OR REPLACE INTO avatarnames (charname, hash, accessed) VALUES (?, ?, ?)",
+                             (name, digest, now))
+            freed = self._deleteUnused([old[0]]) if old and old[0] != digest else 0
+            self.con.commit()
+            size += (len(data) if added > 0 else 0) - freed
+            self._setSize(size)
+        if size > self.MAX_BYTES:
+            self.evict()
+
+    def getAvatar(self, name):
+        """ Returns the picture of the player or None
+        """
+        return self.getAvatars((name,)).get(name)
+
+    def getAvatars(self, names):
+        """ Returns a dict name = picture for all names found in the store
+        """
+        names = list(set(names))
+        avatars = {}
+        stale = []
+        limit = time.time() - self.ACCESS_RESOLUTION
+        for start in range(0, len(names), self.cache.MAX_VARIABLES):
+            chunk = names[start:start + self.cache.MAX_VARIABLES]
+            query = ("SELECT avatarnames.charname, avatarblobs.data, avatarnames.accessed FROM avatarnames "
+                     "JOIN avatarblobs ON avatarblobs.hash = avatarnames.hash "
+                     "WHERE avatarnames.charname IN ({0})").format(", ".join("?" * len(chunk)))
+            for name, data, accessed in self.con.execute(query, chunk):
+                avatars[name] = bytes(data)
+                if accessed < limit:
+                    stale.append(name)
+        if stale:
+            self._touch(stale)
+        return avatars
+
+    def removeAvatar(self, name):
+        with self.writeLock:
+            size = self.size()
+            old = self.con.execute("SELECT hash FROM avatarnames WHERE charname = ?", (name,)).fetchone()
+            self.con.execute("DELETE FROM avatarnames WHERE charname = ?", (name,))
+            freed = self._deleteUnused([old[0]]) if old else 0
+            self.con.commit()
+            self._setSize(size - freed)
+
+    def size(self, exact=False):
+        """ The number of bytes of all stored pictures, exact counts them in the database
+            instead of using the running total
+        """
+        path = self.cache.pathToSQLiteFile
+        size = AvatarStore._sizes.get(path)
+        if size is None or exact:
+            size = self.con.execute("SELECT COALESCE(SUM(size), 0) FROM avatarblobs").fetchone()[0]
+            AvatarStore._sizes[path] = size
+        return size
+
+    def evict(self):
+        """ Drops the least recently shown avatars until the store fits into MAX_BYTES
+        """
+        with self.writeLock:
+            # the running total could be off after a failed write, the eviction goes by the real size
+            size = self.size(exact=True)
+        while size > self.MAX_BYTES:
+            with self.writeLock:
+                rows = self.con.execute("SELECT rowid, hash FROM avatarnames ORDER BY accessed LIMIT ?",
+                                        (self.EVICT_BATCH_SIZE,)).fetchall()
+                self.con.executemany("DELETE FROM avatarnames WHERE rowid = ?", ((row[0],) for row in rows))
+                size -= self._deleteUnused(row[1] for row in rows)
+                self.con.commit()
+                self._setSize(size)
+            if not rows:
+                break
+
+    def _touch(self, names):
+        now = time.time()
+        with self.writeLock:
+            self.con.executemany("UPDATE avatarnames SET accessed = ? WHERE charname = ?",
+                                 ((now, name) for name in names))
+            self.con.commit()
+
+    def _deleteUnused(self, hashes):
+        """ Deletes the pictures of hashes no name refers to anymore, returns the bytes freed.
+            Call it holding the write lock
+        """
+        freed = 0
+        for digest in set(hashes):
+            row = self.con.execute("SELECT size FROM avatarblobs WHERE hash = ? AND NOT EXISTS "
+                                   "(SELECT 1 FROM avatarnames WHERE avatarnames.hash = ?)", (digest, digest)).fetchone()
+            if row:
+                self.con.execute("DELETE FROM avatarblobs WHERE hash = ?", (digest,))
+                freed += row[0]
+        return freed
+
+    def _setSize(self, size):
+        AvatarStore._sizes[self.cache.pathToSQLiteFile] = size
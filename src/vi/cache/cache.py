@@ -17,23 +17,19 @@
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
+import ast
 import sqlite3
-import threading
 import time
-import six
-if six.PY2:
-    def to_blob(x):
-        return buffer(str(x))
-    def from_blob(x):
-        return str(x[0][0])
-else:
-    def to_blob(x):
-        return x
-    def from_blob(x):
-        return x
 
 import logging
+from vi.cache import codec
+from vi.cache import compression
+from vi.cache.avatarstore import AvatarStore
+from vi.cache.connection import ConnectionManager
 from vi.cache.dbstructure import updateDatabase
+from vi.cache.instrumentation import CacheStatistics, TimedLock, namespaceOf
+from vi.cache.memorycache import MemoryCache, MISSING
+from vi.cache.writebehind import WriteBehindQueue
 
 
 class Cache(object):
@@ -46,20 +42,58 @@ class Cache(object):
     # check. Following inits of Cache will now, that we allready checked.
     VERSION_CHECKED = False
 
+    # Hits, misses, latencies and lock waits of all Cache instances, see logStatistics()
+    STATISTICS = CacheStatistics()
+
     # Cache-Instances in various threads: must handle concurrent writings
-    SQLITE_WRITE_LOCK = threading.Lock()
+    SQLITE_WRITE_LOCK = TimedLock(STATISTICS)
+
+    # Rows the sweeper deletes per statement, keeps each write transaction short
+    SWEEP_BATCH_SIZE = 200
+
+    # The sweeper drops the entries closest to expiry while the database is larger, None for no limit
+    MAX_DATABASE_SIZE = 64 * 1024 * 1024
+
+    # The switch to incremental vacuum rewrites the whole database, it is only done on its own while
+    # the data is smaller than this, see enableIncrementalVacuum
+    VACUUM_SWITCH_MAX_SIZE = 16 * 1024 * 1024
+
+    # Outdated values with HTTP validators stay this long for a conditional refresh
+    VALIDATOR_KEEP = 60 * 60 * 24 * 14
+
+    # Player names have no maxAge, the sweeper removes them after this many seconds
+    PLAYERNAME_MAX_AGE = 60 * 60 * 24 * 30
+
+    # Stays below the default SQLITE_MAX_VARIABLE_NUMBER (999) of older sqlite builds
+    MAX_VARIABLES = 500
+
+    # Every thread keeps its own connection, so creating a Cache is cheap
+    CONNECTIONS = ConnectionManager()
+
+    # Hot keys of the cache table are served from memory, shared by all instances
+    MEMORY = MemoryCache()
+
+    # Writes from the UI thread which should not wait for the disk, see putIntoCacheDeferred
+    WRITE_BEHIND = WriteBehindQueue(lambda path, rows: Cache(path)._writeRows(rows))
 
     def __init__(self, pathToSQLiteFile="cache.sqlite3"):
         """ pathToSQLiteFile=path to sqlite-file to save the cache. will be ignored if you set Cache.PATH_TO_CACHE before init
         """
         if Cache.PATH_TO_CACHE:
             pathToSQLiteFile = Cache.PATH_TO_CACHE
-        self.con = sqlite3.connect(pathToSQLiteFile)
+        self.pathToSQLiteFile = pathToSQLiteFile
+        self.avatars = AvatarStore(self, Cache.SQLITE_WRITE_LOCK)
         if not Cache.VERSION_CHECKED:
             with Cache.SQLITE_WRITE_LOCK:
                 self.checkVersion()
         Cache.VERSION_CHECKED = True
 
+    @property
+    def con(self):
+        """ The connection of the calling thread, a Cache may be shared between threads
+        """
+        return Cache.CONNECTIONS.connection(self.pathToSQLiteFile)
+
     def checkVersion(self):
         query = "SELECT version FROM version;"
         version = 0
@@ -74,45 +108,220 @@ class Cache(object):
                 raise e
         updateDatabase(version, self.con)
 
-    def putIntoCache(self, key, value, maxAge=60 * 60 * 24 * 3):
+    def putIntoCache(self, key, value, maxAge=60 * 60 * 24 * 3, etag=None, lastModified=None):
         """ Putting something in the cache maxAge is maximum age in seconds
+            etag, lastModified = the validators of the response value came from, if any
         """
+        now = time.time()
+        data, dataCodec = compression.compress(value)
+        # Outdated values with validators are kept a while for a conditional refresh
+        keep = maxAge + (Cache.VALIDATOR_KEEP if etag or lastModified else 0)
+        # A deferred value of key still waiting would be read instead and written after this one
+        Cache.WRITE_BEHIND.take(self.pathToSQLiteFile, (key,))
         with Cache.SQLITE_WRITE_LOCK:
-            query = "DELETE FROM cache WHERE key = ?"
-            self.con.execute(query, (key,))
-            query = "INSERT INTO cache (key, data, modified, maxAge) VALUES (?, ?, ?, ?)"
-            self.con.execute(query, (key, value, time.time(), maxAge))
+            query = ("INSERT OR REPLACE INTO cache (key, data, modified, maxAge, expires, codec, etag, lastmodified) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+            self.con.execute(query, (key, data, now, maxAge, now + keep, dataCodec, etag, lastModified))
             self.con.commit()
+        Cache.MEMORY.put(key, value, maxAge)
+        Cache.STATISTICS.recordWrite(namespaceOf(key), 1, time.time() - now)
+
+    def putMany(self, items, maxAge=60 * 60 * 24 * 3):
+        """ Putting several values in the cache in one transaction
+            items = dict or iterable of (key, value) pairs
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        self.putRows([(key, value, maxAge) for key, value in items])
+
+    def putRows(self, rows):
+        """ Writing rows of (key, value, maxAge) or (key, value, maxAge, etag, lastModified) in one transaction
+        """
+        # Deferred values of the keys still waiting would be read instead and written after these
+        Cache.WRITE_BEHIND.take(self.pathToSQLiteFile, (row[0] for row in rows))
+        self._writeRows(rows)
+        for row in rows:
+            Cache.MEMORY.put(row[0], row[1], row[2])
+
+    def _writeRows(self, rows):
+        if not rows:
+            return
+        now = time.time()
+        compressed = []
+        for row in rows:
+            key, value, maxAge = row[:3]
+            etag, lastModified = row[3:5] if len(row) > 3 else (None, None)
+            keep = maxAge + (Cache.VALIDATOR_KEEP if etag or lastModified else 0)
+            compressed.append((key, compression.compress(value), maxAge, keep, etag, lastModified))
+        with Cache.SQLITE_WRITE_LOCK:
+            query = ("INSERT OR REPLACE INTO cache (key, data, modified, maxAge, expires, codec, etag, lastmodified) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+            try:
+                self.con.executemany(query, ((key, data, now, maxAge, now + keep, dataCodec, etag, lastModified)
+                                             for key, (data, dataCodec), maxAge, keep, etag, lastModified
+                                             in compressed))
+                self.con.commit()
+            except Exception:
+                self.con.rollback()
+                raise
+        duration = time.time() - now
+        counts = {}
+        for row in rows:
+            namespace = namespaceOf(row[0])
+            counts[namespace] = counts.get(namespace, 0) + 1
+        for namespace, count in counts.items():
+            Cache.STATISTICS.recordWrite(namespace, count, duration)
+
+    def putIntoCacheDeferred(self, key, value, maxAge=60 * 60 * 24 * 3, etag=None, lastModified=None):
+        """ Like putIntoCache, but returns at once; the value is written by a background thread
+            shortly after. Reads see the value right away
+        """
+        Cache.WRITE_BEHIND.put(self.pathToSQLiteFile, key, value, maxAge, etag, lastModified)
+        Cache.MEMORY.put(key, value, maxAge)
+
+    def flush(self):
+        """ Writes all deferred values, call it before the program ends
+        """
+        Cache.WRITE_BEHIND.flush()
 
     def getFromCache(self, key, outdated=False):
         """ Getting a value from cache
             key = the key for the value
             outdated = returns the value also if it is outdated
         """
-        query = "SELECT key, data, modified, maxage FROM cache WHERE key = ?"
+        started = time.time()
+        value = self._getFromCache(key, outdated)
+        hit = 0 if value is None else 1
+        Cache.STATISTICS.recordRead(namespaceOf(key), hit, 1 - hit, time.time() - started)
+        return value
+
+    def _getFromCache(self, key, outdated):
+        value = Cache.WRITE_BEHIND.get(self.pathToSQLiteFile, key, outdated)
+        if value is not MISSING:
+            return value
+        if not outdated:
+            value = Cache.MEMORY.get(key)
+            if value is not MISSING:
+                return value
+        query = "SELECT key, data, modified, maxage, codec FROM cache WHERE key = ?"
         founds = self.con.execute(query, (key,)).fetchall()
         if len(founds) == 0:
             return None
-        elif founds[0][2] + founds[0][3] < time.time() and not outdated:
+        remaining = founds[0][2] + founds[0][3] - time.time()
+        if remaining < 0 and not outdated:
             return None
         else:
-            return founds[0][1]
+            value = compression.decompress(founds[0][1], founds[0][4])
+            Cache.MEMORY.put(key, value, remaining)
+            return value
+
+    def getMany(self, keys, outdated=False):
+        """ Getting several values from cache
+            keys = iterable of keys
+            outdated = returns the values also if they are outdated
+            returns a dict key = key, value = data for the keys found
+        """
+        started = time.time()
+        keys = set(keys)
+        data = self._getMany(keys, outdated)
+        duration = time.time() - started
+        counts = {}
+        for key in keys:
+            namespace = namespaceOf(key)
+            hits, misses = counts.get(namespace, (0, 0))
+            counts[namespace] = (hits + 1, misses) if key in data else (hits, misses + 1)
+        for namespace, (hits, misses) in counts.items():
+            Cache.STATISTICS.recordRead(namespace, hits, misses, duration)
+        return data
+
+    def _getMany(self, keys, outdated):
+        data = {}
+        missing = []
+        for key in keys:
+            value = Cache.WRITE_BEHIND.get(self.pathToSQLiteFile, key, outdated)
+            if value is None:
+                # the newest value of key still waits to be written and is outdated already
+                continue
+            if value is MISSING and not outdated:
+                value = Cache.MEMORY.get(key)
+            if value is MISSING:
+                missing.append(key)
+            else:
+                data[key] = value
+        keys = missing
+        now = time.time()
+        for start in range(0, len(keys), Cache.MAX_VARIABLES):
+            chunk = keys[start:start + Cache.MAX_VARIABLES]
+            query = "SELECT key, data, modified, maxage, codec FROM cache WHERE key IN ({0})".format(
+                ", ".join("?" * len(chunk)))
+            for key, value, modified, maxAge, dataCodec in self.con.execute(query, chunk):
+                remaining = modified + maxAge - now
+                if outdated or remaining >= 0:
+                    value = compression.decompress(value, dataCodec)
+                    data[key] = value
+                    Cache.MEMORY.put(key, value, remaining)
+        return data
+
+    def getValidators(self, key):
+        """ The (etag, lastModified) stored with key, also if the value is outdated. (None, None) if there are none
+        """
+        pending = Cache.WRITE_BEHIND.getValidators(self.pathToSQLiteFile, key)
+        if pending is not None:
+            return pending
+        founds = self.con.execute("SELECT etag, lastmodified FROM cache WHERE key = ?", (key,)).fetchall()
+        if len(founds) == 0:
+            return None, None
+        return founds[0][0], founds[0][1]
+
+    def extend(self, key, maxAge):
+        """ Makes the value of key current again for maxAge seconds, used when the
+            server answered a conditional request with 304. Returns False if there is no such value
+        """
+        pending = Cache.WRITE_BEHIND.take(self.pathToSQLiteFile, (key,)).get(key)
+        if pending is not None:
+            # The value was never written, it is written now with the new age
+            value, _, etag, lastModified = pending[:4]
+            self._writeRows(((key, value, maxAge, etag, lastModified),))
+            Cache.MEMORY.remove(key)
+            return True
+        now = time.time()
+        with Cache.SQLITE_WRITE_LOCK:
+            query = ("UPDATE cache SET modified = ?, maxage = ?, expires = ? + "
+                     "CASE WHEN etag IS NULL AND lastmodified IS NULL THEN 0 ELSE ? END WHERE key = ?")
+            updated = self.con.execute(query, (now, maxAge, now + maxAge, Cache.VALIDATOR_KEEP, key)).rowcount
+            self.con.commit()
+        # the memory tier has the old age, the next read loads it again
+        Cache.MEMORY.remove(key)
+        return updated > 0
+
+    def extendDeferred(self, key, maxAge):
+        """ Like extend, but the write is left to the background thread, see putIntoCacheDeferred
+        """
+        data = self.getFromCache(key, True)
+        if data is None:
+            return False
+        etag, lastModified = self.getValidators(key)
+        self.putIntoCacheDeferred(key, data, maxAge, etag, lastModified)
+        return True
 
     def putPlayerName(self, name, status):
         """ Putting a playername into the cache
         """
+        started = time.time()
         with Cache.SQLITE_WRITE_LOCK:
-            query = "DELETE FROM playernames WHERE charname = ?"
-            self.con.execute(query, (name,))
-            query = "INSERT INTO playernames (charname, status, modified) VALUES (?, ?, ?)"
+            query = "INSERT OR REPLACE INTO playernames (charname, status, modified) VALUES (?, ?, ?)"
             self.con.execute(query, (name, status, time.time()))
             self.con.commit()
+        Cache.STATISTICS.recordWrite("playernames", 1, time.time() - started)
 
     def getPlayerName(self, name):
         """ Getting back infos about playername from Cache. Returns None if the name was not found, else it returns the status
         """
+        started = time.time()
         selectquery = "SELECT charname, status FROM playernames WHERE charname = ?"
         founds = self.con.execute(selectquery, (name,)).fetchall()
+        hit = 1 if founds else 0
+        Cache.STATISTICS.recordRead("playernames", hit, 1 - hit, time.time() - started)
         if len(founds) == 0:
             return None
         else:
@@ -121,45 +330,169 @@ class Cache(object):
     def putAvatar(self, name, data):
         """ Put the picture of an player into the cache
         """
-        with Cache.SQLITE_WRITE_LOCK:
-            # data is a blob, so we have to change it to buffer
-            data = to_blob(data)
-            query = "DELETE FROM avatars WHERE charname = ?"
-            self.con.execute(query, (name,))
-            query = "INSERT INTO avatars (charname, data, modified) VALUES (?, ?, ?)"
-            self.con.execute(query, (name, data, time.time()))
-            self.con.commit()
+        started = time.time()
+        self.avatars.putAvatar(name, data)
+        Cache.STATISTICS.recordWrite("avatars", 1, time.time() - started)
 
     def getAvatar(self, name):
         """ Getting the avatars_pictures data from the Cache. Returns None if there is no entry in the cache
         """
-        selectQuery = "SELECT data FROM avatars WHERE charname = ?"
-        founds = self.con.execute(selectQuery, (name,)).fetchall()
-        if len(founds) == 0:
-            return None
-        else:
-            # dats is buffer, we convert it back to str
-            data = from_blob(founds[0][0])
-            return data
+        return self.getAvatars((name,)).get(name)
+
+    def getAvatars(self, names):
+        """ Getting the pictures of several players, returns a dict name = picture for the names found
+        """
+        started = time.time()
+        names = set(names)
+        avatars = self.avatars.getAvatars(names)
+        Cache.STATISTICS.recordRead("avatars", len(avatars), len(names) - len(avatars), time.time() - started)
+        return avatars
 
     def removeAvatar(self, name):
         """ Removing an avatar from the cache
         """
+        self.avatars.removeAvatar(name)
+
+    def statistics(self):
+        """ The counters and latency histograms per namespace, the write lock waits and the memory tier
+        """
+        data = Cache.STATISTICS.snapshot()
+        data["memory"] = Cache.MEMORY.statistics()
+        return data
+
+    def logStatistics(self, level=logging.INFO):
+        """ Writes the statistics to the log
+        """
+        Cache.STATISTICS.logSummary(level)
+        memory = Cache.MEMORY.statistics()
+        logging.log(level, "cache memory tier: %d entries, %d hits, %d misses, %d evictions", memory["entries"],
+                    memory["hits"], memory["misses"], memory["evictions"])
+
+    def deleteExpired(self, batchSize=None):
+        """ Deletes one batch of expired rows from cache and playernames, returns the number of deleted rows
+        """
+        batchSize = batchSize or Cache.SWEEP_BATCH_SIZE
+        now = time.time()
+        queries = (("DELETE FROM cache WHERE rowid IN "
+                    "(SELECT rowid FROM cache WHERE expires < ? LIMIT ?)", now),
+                   ("DELETE FROM playernames WHERE rowid IN "
+                    "(SELECT rowid FROM playernames WHERE modified < ? LIMIT ?)", now - Cache.PLAYERNAME_MAX_AGE))
+        deleted = 0
+        for query, limit in queries:
+            with Cache.SQLITE_WRITE_LOCK:
+                deleted += self.con.execute(query, (limit, batchSize)).rowcount
+                self.con.commit()
+        return deleted
+
+    def deleteOldest(self, batchSize=None):
+        """ Deletes the batch of cache entries which would expire next, returns the number of deleted rows
+        """
+        batchSize = batchSize or Cache.SWEEP_BATCH_SIZE
         with Cache.SQLITE_WRITE_LOCK:
-            query = "DELETE FROM avatars WHERE charname = ?"
-            self.con.execute(query, (name,))
+            rows = self.con.execute("SELECT rowid, key FROM cache ORDER BY expires LIMIT ?", (batchSize,)).fetchall()
+            self.con.executemany("DELETE FROM cache WHERE rowid = ?", ((row[0],) for row in rows))
             self.con.commit()
+        for row in rows:
+            Cache.MEMORY.remove(row[1])
+        return len(rows)
 
-    def recallAndApplySettings(self, responder, settingsIdentifier):
-        settings = self.getFromCache(settingsIdentifier)
-        if settings:
-            settings = eval(settings)
-            for setting in settings:
-                obj = responder if not setting[0] else getattr(responder, setting[0])
-                # logging.debug("{0} | {1} | {2}".format(str(obj), setting[1], setting[2]))
-                try:
-                    getattr(obj, setting[1])(setting[2])
-                except Exception as e:
-                    logging.error(e)
+    def databaseSize(self):
+        """ The number of bytes in use by the database, free pages not counted
+        """
+        pageSize = self.con.execute("PRAGMA page_size").fetchone()[0]
+        pageCount = self.con.execute("PRAGMA page_count").fetchone()[0]
+        freePages = self.con.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pageCount - freePages) * pageSize
+
+    def enableIncrementalVacuum(self, force=False):
+        """ Switches the database to auto_vacuum=INCREMENTAL, this needs a full VACUUM. A database with
+            more than VACUUM_SWITCH_MAX_SIZE bytes of data is only switched with force.
+            Returns True if the database runs with incremental vacuum
+        """
+        if self.con.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return True
+        size = self.databaseSize()
+        if not force and size > Cache.VACUUM_SWITCH_MAX_SIZE:
+            logging.debug("Cache database with %d bytes is too large to switch to incremental vacuum", size)
+            return False
+        # The write lock is not taken: the other writers wait for the rewrite in sqlite (BUSY_TIMEOUT)
+        # instead of all of them in the lock, the size limit keeps that wait short
+        logging.info("Switching the cache database to incremental vacuum")
+        self.con.commit()
+        self.con.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.con.execute("VACUUM")
+        return True
+
+    def incrementalVacuum(self, pages=500):
+        """ Gives up to pages free pages back to the file system
+        """
+        with Cache.SQLITE_WRITE_LOCK:
+            # execute() steps a statement without result columns only once, so only
+            # one page would be freed; executescript runs it to the end
+            self.con.executescript("PRAGMA incremental_vacuum({0:d});".format(pages))
+
+    def putValue(self, key, value, maxAge=60 * 60 * 24 * 3, etag=None, lastModified=None):
+        """ Putting a structure (dicts, lists, numbers, text, bytes) in the cache, see vi.cache.codec
+        """
+        self.putIntoCache(key, sqlite3.Binary(codec.encode(value)), maxAge, etag, lastModified)
 
+    def putValueDeferred(self, key, value, maxAge=60 * 60 * 24 * 3, etag=None, lastModified=None):
+        """ Like putValue, written by the background thread, see putIntoCacheDeferred
+        """
+        self.putIntoCacheDeferred(key, sqlite3.Binary(codec.encode(value)), maxAge, etag, lastModified)
 
+    def getValue(self, key, outdated=False):
+        """ Getting a structure stored with putValue, None if there is none or it was stored otherwise
+        """
+        data = self.getFromCache(key, outdated)
+        if data is None:
+            return None
+        try:
+            return codec.decode(data)
+        except codec.CodecError as e:
+            logging.debug("Cache value for %s not readable: %s", key, e)
+            return None
+
+    def putSettings(self, settingsIdentifier, settings):
+        """ Saving settings, an iterable of (target, method, value), target = None for the responder itself
+        """
+        rows = [(settingsIdentifier, position, target, method, sqlite3.Binary(codec.encode(value)))
+                for position, (target, method, value) in enumerate(settings)]
+        with Cache.SQLITE_WRITE_LOCK:
+            try:
+                self.con.execute("DELETE FROM settings WHERE identifier = ?", (settingsIdentifier,))
+                self.con.executemany("INSERT INTO settings (identifier, position, target, method, value) "
+                                     "VALUES (?, ?, ?, ?, ?)", rows)
+                self.con.commit()
+            except Exception:
+                self.con.rollback()
+                raise
+
+    def getSettings(self, settingsIdentifier):
+        """ Returns the list of (target, method, value) saved with putSettings. Settings saved
+            by older versions in the cache table are read once as a fallback
+        """
+        query = "SELECT target, method, value FROM settings WHERE identifier = ? ORDER BY position"
+        settings = []
+        for target, method, value in self.con.execute(query, (settingsIdentifier,)):
+            try:
+                settings.append((target, method, codec.decode(value)))
+            except codec.CodecError as e:
+                logging.error("Setting %s.%s not readable: %s", target, method, e)
+        if not settings:
+            legacy = self.getFromCache(settingsIdentifier)
+            if legacy:
+                try:
+                    settings = list(ast.literal_eval(legacy))
+                except (ValueError, SyntaxError) as e:
+                    logging.error("Old settings not readable: %s", e)
+        return settings
+
+    def recallAndApplySettings(self, responder, settingsIdentifier):
+        for setting in self.getSettings(settingsIdentifier):
+            obj = responder if not setting[0] else getattr(responder, setting[0])
+            # logging.debug("{0} | {1} | {2}".format(str(obj), setting[1], setting[2]))
+            try:
+                getattr(obj, setting[1])(setting[2])
+            except Exception as e:
+                logging.error(e)
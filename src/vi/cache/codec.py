@@ -0,0 +1,260 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+"""
+A compact, typed binary encoding for the structures kept in the cache.
+Unlike JSON it keeps int keys, bytes and tuples, and lists of ints or
+int-keyed tables of ints are stored as packed arrays which decode without
+parsing every number.
+"""
+
+import struct
+import sys
+
+from array import array
+
+import six
+
+MAGIC = b"VC\x01"
+
+_NONE, _TRUE, _FALSE = b"N", b"T", b"F"
+_INT, _BIGINT, _FLOAT = b"i", b"j", b"d"
+_TEXT, _BYTES = b"s", b"b"
+_LIST, _TUPLE, _DICT = b"l", b"t", b"m"
+_INTARRAY, _INTMAP, _RECORDS = b"A", b"I", b"R"
+
+# Packed arrays use 32 bit ints in little endian
+_ARRAY_TYPE = "i" if array("i").itemsize == 4 else "l"
+_INT32_MIN, _INT32_MAX = -2 ** 31, 2 ** 31 - 1
+_SWAP = sys.byteorder != "little"
+_INTEGER_TYPES = six.integer_types
+
+
+class CodecError(ValueError):
+    pass
+
+
+def isEncoded(data):
+    if data is None or isinstance(data, six.text_type):
+        return False
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def encode(value):
+    """ Returns the bytes for value
+    """
+    parts = [MAGIC]
+    _encode(value, parts)
+    return b"".join(parts)
+
+
+def decode(data):
+    """ Returns the value encoded in data, raises CodecError if data was not made by encode()
+    """
+    if not isEncoded(data):
+        raise CodecError("not encoded by vi.cache.codec")
+    data = bytes(data)
+    try:
+        value, position = _decode(data, len(MAGIC))
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise CodecError("corrupt data: {0}".format(e))
+    if position != len(data):
+        raise CodecError("trailing data")
+    return value
+
+
+def _isInt(value):
+    return isinstance(value, _INTEGER_TYPES) and not isinstance(value, bool)
+
+
+def _isSmallInt(value):
+    return _isInt(value) and _INT32_MIN <= value <= _INT32_MAX
+
+
+def _packArray(values, parts):
+    packed = array(_ARRAY_TYPE, values)
+    if _SWAP:
+        packed.byteswap()
+    parts.append(struct.pack("<I", len(packed)))
+    parts.append(packed.tobytes() if hasattr(packed, "tobytes") else packed.tostring())
+
+
+def _unpackArray(data, position):
+    count = struct.unpack_from("<I", data, position)[0]
+    position += 4
+    end = position + count * 4
+    if end > len(data):
+        raise IndexError("array out of range")
+    values = array(_ARRAY_TYPE)
+    if hasattr(values, "frombytes"):
+        values.frombytes(data[position:end])
+    else:
+        values.fromstring(data[position:end])
+    if _SWAP:
+        values.byteswap()
+    return values, end
+
+
+def _encodeText(text, parts):
+    raw = text.encode("utf-8")
+    parts.append(struct.pack("<I", len(raw)))
+    parts.append(raw)
+
+
+def _recordFields(value):
+    """ The field names if value is a dict of dicts with the same str keys and int values, else None
+    """
+    fields = None
+    for record in value.values():
+        if not isinstance(record, dict):
+            return None
+        if fields is None:
+            fields = sorted(record)
+            if not fields or not all(isinstance(field, six.string_types) for field in fields):
+                return None
+        elif len(record) != len(fields) or any(field not in record for field in fields):
+            return None
+        if not all(_isSmallInt(v) for v in record.values()):
+            return None
+    return fields
+
+
+def _encode(value, parts):
+    if value is None:
+        parts.append(_NONE)
+    elif value is True:
+        parts.append(_TRUE)
+    elif value is False:
+        parts.append(_FALSE)
+    elif _isSmallInt(value):
+        parts.append(_INT + struct.pack("<i", value))
+    elif _isInt(value):
+        parts.append(_BIGINT)
+        _encodeText(str(value), parts)
+    elif isinstance(value, float):
+        parts.append(_FLOAT + struct.pack("<d", value))
+    elif isinstance(value, six.text_type):
+        parts.append(_TEXT)
+        _encodeText(value, parts)
+    elif isinstance(value, (bytes, bytearray)):
+        parts.append(_BYTES + struct.pack("<I", len(value)))
+        parts.append(bytes(value))
+    elif isinstance(value, (list, tuple)):
+        if isinstance(value, list) and value and all(_isSmallInt(v) for v in value):
+            parts.append(_INTARRAY)
+            _packArray(value, parts)
+            return
+        parts.append((_TUPLE if isinstance(value, tuple) else _LIST) + struct.pack("<I", len(value)))
+        for item in value:
+            _encode(item, parts)
+    elif isinstance(value, dict):
+        keys = list(value)
+        if keys and all(_isSmallInt(k) for k in keys):
+            if all(_isSmallInt(v) for v in value.values()):
+                parts.append(_INTMAP)
+                _packArray(keys, parts)
+                _packArray([value[k] for k in keys], parts)
+                return
+            fields = _recordFields(value)
+            if fields:
+                parts.append(_RECORDS + struct.pack("<I", len(fields)))
+                for field in fields:
+                    _encodeText(six.text_type(field), parts)
+                _packArray(keys, parts)
+                for field in fields:
+                    _packArray([value[k][field] for k in keys], parts)
+                return
+        parts.append(_DICT + struct.pack("<I", len(keys)))
+        for key in keys:
+            _encode(key, parts)
+            _encode(value[key], parts)
+    else:
+        raise CodecError("unable to encode {0}".format(type(value).__name__))
+
+
+def _decodeText(data, position):
+    length = struct.unpack_from("<I", data, position)[0]
+    position += 4
+    if position + length > len(data):
+        raise IndexError("text out of range")
+    return data[position:position + length].decode("utf-8"), position + length
+
+
+def _decode(data, position):
+    tag = data[position:position + 1]
+    position += 1
+    if tag == _NONE:
+        return None, position
+    if tag == _TRUE:
+        return True, position
+    if tag == _FALSE:
+        return False, position
+    if tag == _INT:
+        return struct.unpack_from("<i", data, position)[0], position + 4
+    if tag == _BIGINT:
+        text, position = _decodeText(data, position)
+        return int(text), position
+    if tag == _FLOAT:
+        return struct.unpack_from("<d", data, position)[0], position + 8
+    if tag == _TEXT:
+        return _decodeText(data, position)
+    if tag == _BYTES:
+        length = struct.unpack_from("<I", data, position)[0]
+        position += 4
+        if position + length > len(data):
+            raise IndexError("bytes out of range")
+        return data[position:position + length], position + length
+    if tag in (_LIST, _TUPLE):
+        count = struct.unpack_from("<I", data, position)[0]
+        position += 4
+        items = []
+        for _ in range(count):
+            item, position = _decode(data, position)
+            items.append(item)
+        return (tuple(items) if tag == _TUPLE else items), position
+    if tag == _DICT:
+        count = struct.unpack_from("<I", data, position)[0]
+        position += 4
+        result = {}
+        for _ in range(count):
+            key, position = _decode(data, position)
+            result[key], position = _decode(data, position)
+        return result, position
+    if tag == _INTARRAY:
+        values, position = _unpackArray(data, position)
+        return values.tolist(), position
+    if tag == _INTMAP:
+        keys, position = _unpackArray(data, position)
+        values, position = _unpackArray(data, position)
+        return dict(zip(keys, values)), position
+    if tag == _RECORDS:
+        count = struct.unpack_from("<I", data, position)[0]
+        position += 4
+        fields = []
+        for _ in range(count):
+            field, position = _decodeText(data, position)
+            fields.append(str(field))
+        keys, position = _unpackArray(data, position)
+        columns = []
+        for _ in fields:
+            column, position = _unpackArray(data, position)
+            columns.append(column)
+        return dict((key, dict(zip(fields, row))) for key, row in zip(keys, zip(*columns))), position
+    raise CodecError("unknown tag {0!r}".format(tag))
@@ -0,0 +1,70 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+"""
+Transparent compression of large cache values. Every row of the cache table
+carries the codec its data was stored with, rows written before stay RAW.
+"""
+
+import sqlite3
+import zlib
+
+import six
+
+RAW = 0
+ZLIB_TEXT = 1
+ZLIB_BYTES = 2
+
+# Values shorter than this are not worth the time
+THRESHOLD = 4 * 1024
+
+# Level 6 compresses svg and xml nearly as well as 9 in half the time
+LEVEL = 6
+
+
+def compress(value):
+    """ Returns (data, codec) to store for value
+    """
+    if isinstance(value, six.text_type):
+        raw, codec = value.encode("utf-8"), ZLIB_TEXT
+    elif six.PY2 and isinstance(value, str):
+        # A str in python 2 was stored as text before and read back as unicode
+        raw, codec = value, ZLIB_TEXT
+    elif isinstance(value, (bytes, bytearray, memoryview)) or (six.PY2 and isinstance(value, buffer)):
+        raw, codec = bytes(value), ZLIB_BYTES
+    else:
+        return value, RAW
+    if len(raw) < THRESHOLD:
+        return value, RAW
+    compressed = zlib.compress(raw, LEVEL)
+    if len(compressed) >= len(raw):
+        return value, RAW
+    return sqlite3.Binary(compressed), codec
+
+
+def decompress(data, codec):
+    """ Returns the value stored as data with codec
+    """
+    if not codec:
+        return data
+    raw = zlib.decompress(bytes(data))
+    if codec == ZLIB_TEXT:
+        return raw.decode("utf-8")
+    return raw
@@ -0,0 +1,80 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+import logging
+import sqlite3
+import threading
+
+
+class ConnectionManager(object):
+    """
+        Hands out one long lived sqlite connection per thread and database file.
+        The database runs in WAL mode, so readers in other threads do not wait
+        for a writer and a writer does not wait for the readers.
+    """
+
+    # Seconds a writer waits for the database lock of another connection
+    BUSY_TIMEOUT = 10.0
+
+    # Number of prepared statements sqlite3 keeps per connection
+    CACHED_STATEMENTS = 128
+
+    # NORMAL is safe with WAL, only a power loss may cost the last transactions
+    SYNCHRONOUS = "NORMAL"
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def connection(self, path):
+        """ Returns the connection of the calling thread to path, opens it on first use
+        """
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        con = connections.get(path)
+        if con is None:
+            con = self._connect(path)
+            connections[path] = con
+        return con
+
+    def _connect(self, path):
+        con = sqlite3.connect(path, timeout=self.BUSY_TIMEOUT, cached_statements=self.CACHED_STATEMENTS)
+        try:
+            mode = con.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            if mode.lower() != "wal":
+                logging.warning("Cache database %s runs in journal mode %s", path, mode)
+            con.execute("PRAGMA synchronous={0}".format(self.SYNCHRONOUS))
+        except sqlite3.DatabaseError as e:
+            logging.error("Unable to set up the cache connection: %s", e)
+        logging.debug("Opened cache connection to %s in %s", path, threading.current_thread().name)
+        return con
+
+    def closeConnections(self):
+        """ Closes the connections of the calling thread, call it before a thread ends
+        """
+        connections = getattr(self._local, "connections", None)
+        if not connections:
+            return
+        for con in connections.values():
+            try:
+                con.close()
+            except sqlite3.Error as e:
+                logging.error("Closing cache connection failed: %s", e)
+        connections.clear()
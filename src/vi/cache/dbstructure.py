@@ -41,6 +41,34 @@ def updateDatabase(oldVersion, con):
     if oldVersion < 3:
         queries += ["CREATE TABLE cache (key VARCHAR PRIMARY KEY, data BLOB, modified INT, maxage INT)",
                     "UPDATE version SET version = 3"]
+    if oldVersion < 4:
+        queries += ["ALTER TABLE cache ADD COLUMN expires REAL",
+                    "UPDATE cache SET expires = modified + maxage",
+                    "CREATE INDEX cache_expires ON cache (expires)",
+                    "CREATE INDEX playernames_modified ON playernames (modified)",
+                    "CREATE INDEX avatars_modified ON avatars (modified)",
+                    "UPDATE version SET version = 4"]
+    if oldVersion < 5:
+        # Avatars moved to the deduplicating AvatarStore, the old ones are simply loaded again
+        queries += ["CREATE TABLE avatarblobs (hash VARCHAR PRIMARY KEY, data BLOB, size INT)",
+                    "CREATE TABLE avatarnames (charname VARCHAR PRIMARY KEY, hash VARCHAR, accessed REAL)",
+                    "CREATE INDEX avatarnames_hash ON avatarnames (hash)",
+                    "CREATE INDEX avatarnames_accessed ON avatarnames (accessed)",
+                    "DROP TABLE avatars",
+                    "UPDATE version SET version = 5"]
+    if oldVersion < 6:
+        queries += ["CREATE TABLE settings (identifier VARCHAR, position INT, target VARCHAR, method VARCHAR, "
+                    "value BLOB, PRIMARY KEY (identifier, position))",
+                    "UPDATE version SET version = 6"]
+    if oldVersion < 7:
+        # The codec of vi.cache.compression the data was stored with, 0 = uncompressed
+        queries += ["ALTER TABLE cache ADD COLUMN codec INT DEFAULT 0",
+                    "UPDATE version SET version = 7"]
+    if oldVersion < 8:
+        # The HTTP validators of downloaded values, for conditional requests when they are outdated
+        queries += ["ALTER TABLE cache ADD COLUMN etag VARCHAR",
+                    "ALTER TABLE cache ADD COLUMN lastmodified VARCHAR",
+                    "UPDATE version SET version = 8"]
     for query in queries:
         con.execute(query)
     for update in databaseUpdates:
@@ -0,0 +1,163 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+import logging
+import threading
+import time
+
+# Keys of the cache table are grouped by these prefixes, checked in this order
+NAMESPACES = (("map_", "map_"), ("id_name_", "id_name_"), ("name_id_", "name_id_"),
+              ("playerinfo_id_", "playerinfo_id_"), ("jb_", "jb_"), ("jumpstatistic", "statistics"),
+              ("systemstatistic", "statistics"))
+
+# Upper bounds of the latency buckets in milliseconds, the last bucket takes the rest
+BUCKETS_MSECS = (0.1, 0.5, 1, 5, 10, 50, 100, 500)
+
+
+def namespaceOf(key):
+    for prefix, namespace in NAMESPACES:
+        if key.startswith(prefix):
+            return namespace
+    return "other"
+
+
+class Histogram(object):
+    """ Counts durations into the BUCKETS_MSECS buckets, not thread safe on its own
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MSECS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        msecs = seconds * 1000.0
+        index = 0
+        while index < len(BUCKETS_MSECS) and msecs > BUCKETS_MSECS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += msecs
+        self.maximum = max(self.maximum, msecs)
+
+    def snapshot(self):
+        labels = ["<={0}ms".format(bound) for bound in BUCKETS_MSECS] + [">{0}ms".format(BUCKETS_MSECS[-1])]
+        return {"count": self.count, "mean_ms": self.total / self.count if self.count else 0.0,
+                "max_ms": self.maximum, "buckets": list(zip(labels, self.counts))}
+
+
+class _Namespace(object):
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.reads = Histogram()
+        self.writeTimes = Histogram()
+
+
+class CacheStatistics(object):
+    """
+        Counters and latency histograms of the cache per namespace, plus the time
+        spent waiting for the write lock. Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._namespaces = {}
+            self._lockWaits = Histogram()
+
+    def _namespace(self, namespace):
+        if namespace not in self._namespaces:
+            self._namespaces[namespace] = _Namespace()
+        return self._namespaces[namespace]
+
+    def recordRead(self, namespace, hits, misses, seconds):
+        with self._lock:
+            entry = self._namespace(namespace)
+            entry.hits += hits
+            entry.misses += misses
+            entry.reads.add(seconds)
+
+    def recordWrite(self, namespace, count, seconds):
+        with self._lock:
+            entry = self._namespace(namespace)
+            entry.writes += count
+            entry.writeTimes.add(seconds)
+
+    def recordLockWait(self, seconds):
+        with self._lock:
+            self._lockWaits.add(seconds)
+
+    def snapshot(self):
+        """ Returns a dict: namespace -> counters and histograms, "lock_wait" -> histogram
+        """
+        with self._lock:
+            data = {}
+            for name, entry in self._namespaces.items():
+                data[name] = {"hits": entry.hits, "misses": entry.misses, "writes": entry.writes,
+                              "read": entry.reads.snapshot(), "write": entry.writeTimes.snapshot()}
+            return {"namespaces": data, "lock_wait": self._lockWaits.snapshot()}
+
+    def logSummary(self, level=logging.INFO):
+        data = self.snapshot()
+        for name in sorted(data["namespaces"]):
+            entry = data["namespaces"][name]
+            logging.log(level, "cache %-15s hits %6d misses %6d writes %6d | read mean %.2fms max %.2fms "
+                        "| write mean %.2fms max %.2fms", name, entry["hits"], entry["misses"], entry["writes"],
+                        entry["read"]["mean_ms"], entry["read"]["max_ms"], entry["write"]["mean_ms"],
+                        entry["write"]["max_ms"])
+            logging.log(level, "cache %-15s read latency %s", name, _formatBuckets(entry["read"]["buckets"]))
+        wait = data["lock_wait"]
+        logging.log(level, "cache write lock: %d waits, mean %.2fms max %.2fms, %s", wait["count"], wait["mean_ms"],
+                    wait["max_ms"], _formatBuckets(wait["buckets"]))
+
+
+def _formatBuckets(buckets):
+    return " ".join("{0}:{1}".format(label, count) for label, count in buckets if count)
+
+
+class TimedLock(object):
+    """ A lock which reports how long each acquire waited
+    """
+
+    def __init__(self, statistics):
+        self.statistics = statistics
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True):
+        started = time.time()
+        acquired = self._lock.acquire(blocking)
+        self.statistics.recordLockWait(time.time() - started)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.release()
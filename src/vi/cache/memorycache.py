@@ -0,0 +1,90 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+import threading
+import time
+
+from collections import OrderedDict
+
+# Returned by MemoryCache.get when the key is not cached
+MISSING = object()
+
+
+class MemoryCache(object):
+    """
+        A bounded in-memory tier in front of the sqlite cache. Every entry expires
+        with the maxAge it was put with, the least recently used entry is dropped
+        when the cache is full. Safe to use from several threads.
+    """
+
+    def __init__(self, maxEntries=1024, maxValueSize=256 * 1024):
+        """ maxValueSize = values longer than this are not kept in memory
+        """
+        self.maxEntries = maxEntries
+        self.maxValueSize = maxValueSize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[1] < time.time():
+                self.misses += 1
+                return default
+            # Reinserting moves the key to the end, the most recently used one
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, maxAge):
+        self.putMany(((key, value),), maxAge)
+
+    def putMany(self, items, maxAge):
+        expires = time.time() + maxAge
+        with self._lock:
+            for key, value in items:
+                self._entries.pop(key, None)
+                if maxAge <= 0 or (hasattr(value, "__len__") and len(value) > self.maxValueSize):
+                    continue
+                self._entries[key] = (value, expires)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def remove(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def statistics(self):
+        """ Returns a dict with the counters and the number of entries
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries)}
@@ -0,0 +1,139 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+import logging
+import threading
+import time
+
+from vi.cache.memorycache import MISSING
+
+
+class WriteBehindQueue(object):
+    """
+        Takes cache writes without touching the disk. A background thread writes
+        them every FLUSH_INTERVAL seconds in one transaction per database; a key
+        written several times in between is only written once, with its last value.
+        writer = callable(path, rows) which writes rows of (key, value, maxAge, etag,
+        lastModified) to the database at path
+    """
+
+    FLUSH_INTERVAL = 0.5
+
+    def __init__(self, writer):
+        self.writer = writer
+        self._pending = {}
+        # The batch being written, still served by get() until it is on disk
+        self._writing = {}
+        self._lock = threading.Lock()
+        # Keeps the batches in order when flush() and the thread write at the same time
+        self._drainLock = threading.Lock()
+        self._thread = None
+
+    def put(self, path, key, value, maxAge, etag=None, lastModified=None):
+        with self._lock:
+            self._pending[(path, key)] = (value, maxAge, etag, lastModified, time.time())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="CacheWriteBehind")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def get(self, path, key, outdated=False):
+        """ The value waiting to be written for key, MISSING if there is none and None
+            if it is older than its maxAge (unless outdated)
+        """
+        with self._lock:
+            pending = self._pending.get((path, key)) or self._writing.get((path, key))
+        if pending is None:
+            return MISSING
+        if not outdated and pending[4] + pending[1] < time.time():
+            return None
+        return pending[0]
+
+    def getValidators(self, path, key):
+        """ The (etag, lastModified) waiting to be written with key, None if nothing waits
+        """
+        with self._lock:
+            pending = self._pending.get((path, key)) or self._writing.get((path, key))
+        return None if pending is None else pending[2:4]
+
+    def take(self, path, keys):
+        """ Removes what waits to be written for keys, call it before writing them directly.
+            Returns a dict key = (value, maxAge, etag, lastModified, queued) of the removed entries.
+            If one of the keys is being written right now, waits for that batch to be on disk,
+            so it can not overwrite the direct write
+        """
+        keys = set(keys)
+        with self._lock:
+            if not any((path, key) in self._writing for key in keys):
+                return self._pop(path, keys)
+        with self._drainLock:
+            with self._lock:
+                return self._pop(path, keys)
+
+    def _pop(self, path, keys):
+        taken = {}
+        for key in keys:
+            entry = self._pending.pop((path, key), None)
+            if entry is not None:
+                taken[key] = entry
+        return taken
+
+    def flush(self):
+        """ Writes everything pending in the calling thread, returns when it is on disk
+        """
+        self._drain()
+
+    def _run(self):
+        while True:
+            time.sleep(self.FLUSH_INTERVAL)
+            try:
+                self._drain()
+            except Exception as e:
+                logging.error("Error in the cache write behind: %s", e)
+
+    def _drain(self):
+        with self._drainLock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._writing = pending
+            if not pending:
+                return
+            try:
+                self._write(pending)
+            finally:
+                with self._lock:
+                    self._writing = {}
+
+    def _write(self, pending):
+        batches = {}
+        for (path, key), entry in pending.items():
+            batches.setdefault(path, []).append((key, entry))
+        failed = None
+        for path, entries in batches.items():
+            try:
+                self.writer(path, [(key,) + entry[:4] for key, entry in entries])
+            except Exception as e:
+                failed = e
+                # Put back what is not newer in the queue, so it is tried again
+                with self._lock:
+                    for key, entry in entries:
+                        self._pending.setdefault((path, key), entry)
+        if failed is not None:
+            raise failed
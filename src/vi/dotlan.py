@@ -24,10 +24,11 @@
 import math
 import time
 import six
-import requests
 import logging
+import zlib
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, CData
+from vi import httpclient
 from vi import states
 from vi.cache.cache import Cache
 
@@ -37,6 +38,61 @@ JB_COLORS = ("800000", "808000", "BC8F8F", "ff00ff", "c83737", "FF6347", "917c6f
              "88aa00" "FFE4E1", "008080", "00BFFF", "4682B4", "00FF7F", "7FFF00", "ff6600",
              "CD5C5C", "FFD700", "66CDAA", "AFEEEE", "5F9EA0", "FFDEAD", "696969", "2F4F4F")
 
+# Runs inside the web view: fades the select marker and ticks the stopwatches from their
+# alarmtime, so the map only has to be re-rendered when the state of a system changes.
+ANIMATION_SCRIPT = u"""
+(function () {
+    var svg = document.getElementsByTagName("svg")[0];
+    var marker = document.getElementById("select_marker");
+    var stopwatches = document.querySelectorAll("text.stopwatch");
+    var secondsUntilWhite = 10 * 60;
+
+    function now() {
+        return new Date().getTime() / 1000;
+    }
+
+    function pad(value) {
+        return value < 10 ? "0" + value : "" + value;
+    }
+
+    function fadeMarker() {
+        var opacity = 1 - (now() - parseFloat(marker.getAttribute("activated"))) / 10;
+        marker.setAttribute("opacity", opacity > 0 ? opacity : 0);
+        if (opacity > 0) {
+            setTimeout(fadeMarker, 100);
+        }
+    }
+
+    function tickStopwatches() {
+        var showSeconds = svg.getAttribute("showseconds") != "0";
+        for (var i = 0; i < stopwatches.length; i++) {
+            var stopwatch = stopwatches[i];
+            var diff = Math.floor(now() - parseFloat(stopwatch.getAttribute("alarmtime")));
+            var minutes = Math.floor(diff / 60);
+            var clock = showSeconds ? pad(minutes) + ":" + pad(diff - minutes * 60) : pad(minutes) + "m";
+            if ((" " + stopwatch.getAttribute("class") + " ").indexOf(" clear ") >= 0) {
+                clock = "clr: " + clock;
+                var value = Math.min(255, Math.floor(diff / (secondsUntilWhite / 255)));
+                var rects = stopwatch.parentNode.getElementsByTagName("rect");
+                for (var j = 0; j < rects.length; j++) {
+                    rects[j].style.fill = "rgb(" + value + ",255," + value + ")";
+                }
+                if (value == 255) {
+                    stopwatch.style.fill = "#008100";
+                }
+            }
+            stopwatch.textContent = clock;
+        }
+    }
+
+    if (marker) {
+        fadeMarker();
+    }
+    tickStopwatches();
+    setInterval(tickStopwatches, 1000);
+})();
+"""
+
 
 class DotlanException(Exception):
     def __init__(self, *args, **kwargs):
@@ -50,20 +106,52 @@ class Map(object):
 
     DOTLAN_BASIC_URL = u"http://evemaps.dotlan.net/svg/{0}.svg"
 
+    # Below this zoom factor stopwatches show only minutes and statistics are hidden
+    DETAIL_ZOOM_FACTOR = 0.8
+
     @property
     def svg(self):
-        # Re-render all systems
+        self.update()
+        return self.serialize()
+
+    def serialize(self):
+        """ Returns the soup as string and forgets about the changes made until now
+        """
+        content = str(self.soup)
+        self._changed = False
         for system in self.systems.values():
-            system.update()
+            system.changed = False
+        return content
+
+    def hasChanges(self):
+        """ Was something changed in the soup since the last serialize()?
+        """
+        return self._changed or any(system.changed for system in self.systems.values())
+
+    def setClientSideAnimation(self, enabled):
+        """
+            With client side animation the page animates the stopwatches and the
+            marker itself, update() only brings the state of the systems up to date.
+        """
+        self.clientSideAnimation = enabled
+        self._changed = True
+
+    def update(self):
+        """
+            Brings the systems and the marker up to date without serializing the soup.
+            Renderers that do not need the svg string call this directly.
+        """
+        # Re-render the systems in view, the others are reconciled when they get visible
+        for system in self.visibleSystems:
+            self._updateSystem(system)
         # Update the marker
-        if not self.marker["opacity"] == "0":
+        if not self.clientSideAnimation and not self.marker["opacity"] == "0":
             now = time.time()
             newValue = (1 - (now - float(self.marker["activated"])) / 10)
             if newValue < 0:
                 newValue = "0"
             self.marker["opacity"] = newValue
-        content = str(self.soup)
-        return content
+            self._changed = True
 
     def __init__(self, region, svgFile=None):
         self.region = region
@@ -78,7 +166,6 @@ class Map(object):
         if not svg:
             try:
                 svg = self._getSvgFromDotlan(self.region)
-                cache.putIntoCache("map_" + self.region, svg, evegate.secondsTillDowntime() + 60 * 60)
             except Exception as e:
                 self.outdatedCacheError = e
                 svg = cache.getFromCache("map_" + self.region, True)
@@ -101,6 +188,88 @@ class Map(object):
         self._jumpMapsVisible = False
         self._statisticsVisible = False
         self.marker = self.soup.select("#select_marker")[0]
+        self.jumpBridges = []
+        # (sys1, connection, sys2) -> line in the soup, and the systems carrying a bridge marker
+        self._jumpbridgeLines = {}
+        self._jumpbridgeSystems = set()
+        self.svgGeometry = self._readSvgGeometry(self.soup)
+        self.visibleSystems = set(self.systems.values())
+        self._viewport = None
+        self._detailed = True
+        self.clientSideAnimation = False
+        self._changed = True
+
+    def _readSvgGeometry(self, soup):
+        """ Returns (viewBox, width, height) of the svg or None if they are not usable
+        """
+        svg = soup.select("svg")[0]
+        try:
+            viewBox = [float(value) for value in svg["viewbox"].replace(",", " ").split()]
+            if len(viewBox) != 4:
+                return None
+            width = float(svg.get("width", viewBox[2]))
+            height = float(svg.get("height", viewBox[3]))
+            return viewBox, width, height
+        except (KeyError, ValueError):
+            return None
+
+    def mapRectFromPage(self, x, y, width, height, zoomFactor=1.0):
+        """
+            Converts a rect of the rendered page (in pixels, as the web view
+            scrolls) to map coordinates. Returns None if this is not possible.
+        """
+        if not self.svgGeometry:
+            return None
+        viewBox, svgWidth, svgHeight = self.svgGeometry
+        # The svg is scaled like preserveAspectRatio="xMidYMid meet"
+        scale = min(svgWidth / viewBox[2], svgHeight / viewBox[3]) * zoomFactor
+        offsetX = (svgWidth * zoomFactor - viewBox[2] * scale) / 2
+        offsetY = (svgHeight * zoomFactor - viewBox[3] * scale) / 2
+        return (viewBox[0] + (x - offsetX) / scale, viewBox[1] + (y - offsetY) / scale, width / scale, height / scale)
+
+    def setViewport(self, rect=None, zoomFactor=1.0):
+        """
+            Tells the map which part is visible.
+            rect = (x, y, width, height) in map coordinates, None for the whole map
+            Only systems inside the viewport are updated on every tick. Returns the
+            systems which came into view, they are brought up to date immediately.
+        """
+        detailed = zoomFactor >= self.DETAIL_ZOOM_FACTOR
+        detailChanged = detailed != self._detailed
+        self._detailed = detailed
+        self._viewport = rect
+        if rect is None:
+            visible = set(self.systems.values())
+        else:
+            visible = set(system for system in self.systems.values() if system.intersects(rect))
+        entered = visible if detailChanged else visible - self.visibleSystems
+        self.visibleSystems = visible
+        if detailChanged:
+            self.soup.select("svg")[0]["showseconds"] = "1" if detailed else "0"
+            self._applyStatisticsVisibility()
+        for system in entered:
+            self._updateSystem(system)
+        return entered
+
+    def _updateSystem(self, system):
+        system.update(self._detailed, not self.clientSideAnimation)
+        if self.statisticsShown():
+            system.applyStatistics()
+
+    def statisticsShown(self):
+        """ Statistics are switched on and the zoom is high enough to show them
+        """
+        return self._statisticsVisible and self._detailed
+
+    def _applyStatisticsVisibility(self):
+        shown = self.statisticsShown()
+        value = "visible" if shown else "hidden"
+        for line in self.soup.select(".statistics"):
+            line["visibility"] = value
+        self._changed = True
+        if shown:
+            for system in self.visibleSystems:
+                system.applyStatistics()
 
     def _extractSystemsFromSoup(self, soup):
         systems = {}
@@ -175,6 +344,12 @@ class Map(object):
             svgtext["class"] = ["statistics", ]
             svgtext.string = text
             jumps.append(svgtext)
+            system.statisticsElement = svgtext
+
+        # The animations of marker and stopwatches, see ANIMATION_SCRIPT
+        script = soup.new_tag("script", type="text/ecmascript", id="vintel_animation")
+        script.string = CData(ANIMATION_SCRIPT)
+        svg.append(script)
 
     def _connectNeighbours(self):
         """
@@ -191,82 +366,136 @@ class Map(object):
                 startSystem.addNeighbour(stopSystem)
 
     def _getSvgFromDotlan(self, region):
+        """ Downloads the svg into the cache, unless dotlan says the outdated one there is still current
+        """
         url = self.DOTLAN_BASIC_URL.format(region)
-        content = requests.get(url).text
+        cacheKey = "map_" + region
+        cache = Cache()
+        maxAge = evegate.secondsTillDowntime() + 60 * 60
+        response = httpclient.refresh(url, cache, cacheKey, maxAge)
+        if response is None:
+            return cache.getFromCache(cacheKey)
+        content = response.text
+        etag, lastModified = httpclient.validatorsOf(response)
+        cache.putIntoCache(cacheKey, content, maxAge, etag, lastModified)
         return content
 
     def addSystemStatistics(self, statistics):
+        """
+            Takes the statistics of the whole universe (systemId -> dict), only the
+            systems of this region are looked at. Returns the set of systems whose
+            numbers changed since the last call, only their labels are touched.
+        """
         logging.info("addSystemStatistics start")
+        changed = set()
         if statistics is not None:
-            for systemId, system in self.systemsById.items():
-                if systemId in statistics:
-                    system.setStatistics(statistics[systemId])
+            for systemId in set(self.systemsById).intersection(statistics):
+                system = self.systemsById[systemId]
+                if system.setStatistics(statistics[systemId]):
+                    changed.add(system)
         else:
             for system in self.systemsById.values():
-                system.setStatistics(None)
-        logging.info("addSystemStatistics complete")
+                if system.setStatistics(None):
+                    changed.add(system)
+        if changed and self.statisticsShown():
+            for system in changed.intersection(self.visibleSystems):
+                system.applyStatistics()
+        logging.info("addSystemStatistics complete, %d systems changed", len(changed))
+        return changed
 
 
     def setJumpbridges(self, jumpbridgesData):
         """
             Adding the jumpbridges to the map soup; format of data:
             tuples with 3 values (sys1, connection, sys2)
+            The data is compared with the bridges already on the map, only the bridges
+            which were added or removed touch the soup.
         """
-        soup = self.soup
-        for bridge in soup.select(".jumpbridge"):
-            bridge.decompose()
-        jumps = soup.select("#jumps")[0]
-        colorCount = 0
-
+        wanted = []
+        seen = set()
         for bridge in jumpbridgesData:
-            sys1 = bridge[0]
-            connection = bridge[1]
-            sys2 = bridge[2]
+            sys1, connection, sys2 = bridge[0], bridge[1], bridge[2]
             if not (sys1 in self.systems and sys2 in self.systems):
                 continue
-
-            if colorCount > len(JB_COLORS) - 1:
-                colorCount = 0
-            jbColor = JB_COLORS[colorCount]
-            colorCount += 1
-            systemOne = self.systems[sys1]
-            systemTwo = self.systems[sys2]
-            systemOneCoords = systemOne.mapCoordinates
-            systemTwoCoords = systemTwo.mapCoordinates
-            systemOneOffsetPoint = systemOne.getTransformOffsetPoint()
-            systemTwoOffsetPoint = systemTwo.getTransformOffsetPoint()
-
-            systemOne.setJumpbridgeColor(jbColor)
-            systemTwo.setJumpbridgeColor(jbColor)
-
-            # Construct the line, color it and add it to the jumps
-            line = soup.new_tag("line", x1=systemOneCoords["center_x"] + systemOneOffsetPoint[0],
-                                y1=systemOneCoords["center_y"] + systemOneOffsetPoint[1],
-                                x2=systemTwoCoords["center_x"] + systemTwoOffsetPoint[0],
-                                y2=systemTwoCoords["center_y"] + systemTwoOffsetPoint[1], visibility="hidden",
-                                style="stroke:#{0}".format(jbColor))
-            line["stroke-width"] = 2
-            line["class"] = ["jumpbridge", ]
-            if "<" in connection:
-                line["marker-start"] = "url(#arrowstart_{0})".format(jbColor)
-            if ">" in connection:
-                line["marker-end"] = "url(#arrowend_{0})".format(jbColor)
-            jumps.insert(0, line)
+            key = (sys1, connection, sys2)
+            if key not in seen:
+                seen.add(key)
+                wanted.append(key)
+
+        removed = [key for key in self._jumpbridgeLines if key not in seen]
+        added = [key for key in wanted if key not in self._jumpbridgeLines]
+        for key in removed:
+            self._jumpbridgeLines.pop(key).decompose()
+        if added:
+            jumps = self.soup.select("#jumps")[0]
+            for key in added:
+                line = self._createJumpbridgeLine(key)
+                jumps.insert(0, line)
+                self._jumpbridgeLines[key] = line
+
+        # A system with more than one bridge shows the color of the last one in key order,
+        # the order the data comes in does not change the map
+        markerColors = {}
+        jumpBridges = []
+        for key in sorted(wanted):
+            jbColor = jumpbridgeColor(key[0], key[2])
+            systemOne = self.systems[key[0]]
+            systemTwo = self.systems[key[2]]
+            markerColors[systemOne] = jbColor
+            markerColors[systemTwo] = jbColor
+            jumpBridges.append((systemOne, key[1], systemTwo, jbColor))
+        visibility = "visible" if self._jumpMapsVisible else "hidden"
+        for system in self._jumpbridgeSystems.difference(markerColors):
+            system.setJumpbridgeColor(None)
+        for system, jbColor in markerColors.items():
+            system.setJumpbridgeColor(jbColor, visibility)
+        self._jumpbridgeSystems = set(markerColors)
+
+        if removed or added:
+            self.jumpBridges = jumpBridges
+            self._changed = True
+        logging.info("setJumpbridges: %d added, %d removed", len(added), len(removed))
+
+    def _createJumpbridgeLine(self, key):
+        sys1, connection, sys2 = key
+        jbColor = jumpbridgeColor(sys1, sys2)
+        systemOne = self.systems[sys1]
+        systemTwo = self.systems[sys2]
+        systemOneCoords = systemOne.mapCoordinates
+        systemTwoCoords = systemTwo.mapCoordinates
+        systemOneOffsetPoint = systemOne.getTransformOffsetPoint()
+        systemTwoOffsetPoint = systemTwo.getTransformOffsetPoint()
+
+        # Construct the line, color it and add it to the jumps
+        line = self.soup.new_tag("line", x1=systemOneCoords["center_x"] + systemOneOffsetPoint[0],
+                                 y1=systemOneCoords["center_y"] + systemOneOffsetPoint[1],
+                                 x2=systemTwoCoords["center_x"] + systemTwoOffsetPoint[0],
+                                 y2=systemTwoCoords["center_y"] + systemTwoOffsetPoint[1],
+                                 visibility="visible" if self._jumpMapsVisible else "hidden",
+                                 style="stroke:#{0}".format(jbColor))
+        line["stroke-width"] = 2
+        line["class"] = ["jumpbridge", ]
+        if "<" in connection:
+            line["marker-start"] = "url(#arrowstart_{0})".format(jbColor)
+        if ">" in connection:
+            line["marker-end"] = "url(#arrowend_{0})".format(jbColor)
+        return line
 
     def changeStatisticsVisibility(self):
         newStatus = False if self._statisticsVisible else True
-        value = "visible" if newStatus else "hidden"
-        for line in self.soup.select(".statistics"):
-            line["visibility"] = value
         self._statisticsVisible = newStatus
+        self._applyStatisticsVisibility()
         return newStatus
 
     def changeJumpbridgesVisibility(self):
         newStatus = False if self._jumpMapsVisible else True
         value = "visible" if newStatus else "hidden"
-        for line in self.soup.select(".jumpbridge"):
+        for line in self._jumpbridgeLines.values():
             line["visibility"] = value
+        for system in self._jumpbridgeSystems:
+            system.jumpbridgeMarker["visibility"] = value
         self._jumpMapsVisible = newStatus
+        self._changed = True
         # self.debugWriteSoup()
         return newStatus
 
@@ -292,6 +521,8 @@ class System(object):
     CLEAR_COLOR = "#59FF6C"
 
     def __init__(self, name, svgElement, mapSoup, mapCoordinates, transform, systemId):
+        # Set whenever the svg of the system was modified, reset by Map.serialize()
+        self.changed = True
         self.status = states.UNKNOWN
         self.name = name
         self.svgElement = svgElement
@@ -310,6 +541,27 @@ class System(object):
         self.cachedOffsetPoint = None
         self._neighbours = set()
         self.statistics = {"jumps": "?", "shipkills": "?", "factionkills": "?", "podkills": "?"}
+        self.statisticsText = "stats n/a"
+        self.statisticsElement = None
+        self.jumpbridgeMarker = None
+        self._statisticsApplied = True
+        self._bounds = None
+
+    def getBounds(self):
+        """ The (x, y, width, height) of the system on the map, transform included
+        """
+        if not self._bounds:
+            coords = self.mapCoordinates
+            offsetPoint = self.getTransformOffsetPoint()
+            self._bounds = (coords["x"] + offsetPoint[0], coords["y"] + offsetPoint[1], coords["width"],
+                            coords["height"])
+        return self._bounds
+
+    def intersects(self, rect):
+        x, y, width, height = self.getBounds()
+        # The statistics text is below the system, so there is a bit of room around it
+        return (x + width + 20 > rect[0] and x - 20 < rect[0] + rect[2] and
+                y + height + 20 > rect[1] and y - 20 < rect[1] + rect[3])
 
     def getTransformOffsetPoint(self):
         if not self.cachedOffsetPoint:
@@ -321,19 +573,33 @@ class System(object):
                 self.cachedOffsetPoint = [0.0, 0.0]
         return self.cachedOffsetPoint
 
-    def setJumpbridgeColor(self, color):
+    def setJumpbridgeColor(self, color, visibility="hidden"):
+        """ Sets the color of the bridge marker of the system, None removes the marker
+        """
+        style = "fill:{0};stroke:{0};stroke-width:2;fill-opacity:0.4"
+        if color is None:
+            if self.jumpbridgeMarker is not None:
+                self.jumpbridgeMarker.decompose()
+                self.jumpbridgeMarker = None
+                self.changed = True
+            return
+        style = style.format(color)
+        if self.jumpbridgeMarker is not None:
+            if self.jumpbridgeMarker["style"] != style:
+                self.jumpbridgeMarker["style"] = style
+                self.changed = True
+            return
         idName = self.name + u"_jb_marker"
-        for element in self.mapSoup.select(u"#" + idName):
-            element.decompose()
         coords = self.mapCoordinates
         offsetPoint = self.getTransformOffsetPoint()
         x = coords["x"] - 3 + offsetPoint[0]
         y = coords["y"] + offsetPoint[1]
-        style = "fill:{0};stroke:{0};stroke-width:2;fill-opacity:0.4"
-        tag = self.mapSoup.new_tag("rect", x=x, y=y, width=coords["width"] + 1.5, height=coords["height"], id=idName, style=style.format(color), visibility="hidden")
+        tag = self.mapSoup.new_tag("rect", x=x, y=y, width=coords["width"] + 1.5, height=coords["height"], id=idName, style=style, visibility=visibility)
         tag["class"] = ["jumpbridge", ]
         jumps = self.mapSoup.select("#jumps")[0]
         jumps.insert(0, tag)
+        self.jumpbridgeMarker = tag
+        self.changed = True
 
     def mark(self):
         marker = self.mapSoup.select("#select_marker")[0]
@@ -343,6 +609,7 @@ class System(object):
         marker["transform"] = "translate({x},{y})".format(x=x, y=y)
         marker["opacity"] = "1"
         marker["activated"] = time.time()
+        self.changed = True
 
     def addLocatedCharacter(self, charname):
         idName = self.name + u"_loc"
@@ -356,11 +623,13 @@ class System(object):
                     transform=self.transform)
             jumps = self.mapSoup.select("#jumps")[0]
             jumps.insert(0, newTag)
+            self.changed = True
 
     def setBackgroundColor(self, color):
         for rect in self.svgElement("rect"):
             if "location" not in rect.get("class", []) and "marked" not in rect.get("class", []):
                 rect["style"] = "fill: {0};".format(color)
+        self.changed = True
 
     def getLocatedCharacters(self):
         characters = []
@@ -376,6 +645,7 @@ class System(object):
             if not self.__locatedCharacters:
                 for element in self.mapSoup.select("#" + idName):
                     element.decompose()
+                self.changed = True
 
     def addNeighbour(self, neighbourSystem):
         """
@@ -418,11 +688,18 @@ class System(object):
         if self in system._neighbours:
             system._neigbours.remove(self)
 
+    def _setSecondLineClass(self, className, present):
+        classes = self.secondLine["class"]
+        if present and className not in classes:
+            classes.append(className)
+        elif not present and className in classes:
+            classes.remove(className)
+
     def setStatus(self, newStatus):
         if newStatus == states.ALARM:
             self.lastAlarmTime = time.time()
-            if "stopwatch" not in self.secondLine["class"]:
-                self.secondLine["class"].append("stopwatch")
+            self._setSecondLineClass("stopwatch", True)
+            self._setSecondLineClass("clear", False)
             self.secondLine["alarmtime"] = self.lastAlarmTime
             self.secondLine["style"] = "fill: #FFFFFF;"
             self.setBackgroundColor(self.ALARM_COLOR)
@@ -430,8 +707,8 @@ class System(object):
             self.lastAlarmTime = time.time()
             self.setBackgroundColor(self.CLEAR_COLOR)
             self.secondLine["alarmtime"] = 0
-            if "stopwatch" not in self.secondLine["class"]:
-                self.secondLine["class"].append("stopwatch")
+            self._setSecondLineClass("stopwatch", True)
+            self._setSecondLineClass("clear", True)
             self.secondLine["alarmtime"] = self.lastAlarmTime
             self.secondLine["style"] = "fill: #000000;"
             self.secondLine.string = "clear"
@@ -441,20 +718,46 @@ class System(object):
         elif newStatus == states.UNKNOWN:
             self.setBackgroundColor(self.UNKNOWN_COLOR)
             # second line in the rects is reserved for the clock
+            self._setSecondLineClass("stopwatch", False)
+            self._setSecondLineClass("clear", False)
             self.secondLine.string = "?"
             self.secondLine["style"] = "fill: #000000;"
         if newStatus not in (states.NOT_CHANGE, states.REQUEST):  # unknown not affect system status
             self.status = newStatus
 
     def setStatistics(self, statistics):
+        """ Stores the statistics, returns True if the numbers differ from the last ones
+        """
         if statistics is None:
-            text = "stats n/a"
+            if self.statisticsText == "stats n/a":
+                return False
+            self.statistics = {"jumps": "?", "shipkills": "?", "factionkills": "?", "podkills": "?"}
+            self.statisticsText = "stats n/a"
         else:
-            text = "j-{jumps} f-{factionkills} s-{shipkills} p-{podkills}".format(**statistics)
-        svgtext = self.mapSoup.select("#stats_" + str(self.systemId))[0]
-        svgtext.string = text
-
-    def update(self):
+            if statistics == self.statistics and self.statisticsText != "stats n/a":
+                return False
+            self.statistics = statistics
+            self.statisticsText = "j-{jumps} f-{factionkills} s-{shipkills} p-{podkills}".format(**statistics)
+        self._statisticsApplied = False
+        return True
+
+    def applyStatistics(self):
+        """ Writes the statistics text into the svg, if it changed since the last time
+        """
+        if self._statisticsApplied:
+            return
+        svgtext = self.statisticsElement
+        if svgtext is None:
+            svgtext = self.statisticsElement = self.mapSoup.select("#stats_" + str(self.systemId))[0]
+        svgtext.string = self.statisticsText
+        self._statisticsApplied = True
+        self.changed = True
+
+    def update(self, showSeconds=True, tickClock=True):
+        """
+            showSeconds = False shows only the minutes on the stopwatch
+            tickClock = False leaves the stopwatch and the clear fading to the page script
+        """
         # state changed?
         if (self.status == states.ALARM):
             alarmTime = time.time() - self.lastAlarmTime
@@ -466,21 +769,35 @@ class System(object):
                             if "location" not in rect.get("class", []) and "marked" not in rect.get("class", []):
                                 rect["style"] = "fill: {0};".format(self.backgroundColor)
                         self.secondLine["style"] = "fill: {0};".format(secondLineColor)
+                        self.changed = True
                     break
-        if self.status in (states.ALARM, states.WAS_ALARMED, states.CLEAR):  # timer
+        if tickClock and self.status in (states.ALARM, states.WAS_ALARMED, states.CLEAR):  # timer
             diff = math.floor(time.time() - self.lastAlarmTime)
             minutes = int(math.floor(diff / 60))
             seconds = int(diff - minutes * 60)
-            string = "{m:02d}:{s:02d}".format(m=minutes, s=seconds)
+            if showSeconds:
+                clock = "{m:02d}:{s:02d}".format(m=minutes, s=seconds)
+            else:
+                clock = "{m:02d}m".format(m=minutes)
+            string = clock
             if self.status == states.CLEAR:
                 secondsUntilWhite = 10 * 60
                 calcValue = int(diff / (secondsUntilWhite / 255.0))
                 if calcValue > 255:
                     calcValue = 255
                     self.secondLine["style"] = "fill: #008100;"
-                string = "clr: {m:02d}:{s:02d}".format(m=minutes, s=seconds)
+                string = "clr: " + clock
                 self.setBackgroundColor("rgb({r},{g},{b})".format(r=calcValue, g=255, b=calcValue))
-            self.secondLine.string = string
+            if self.secondLine.string != string:
+                self.secondLine.string = string
+                self.changed = True
+
+
+def jumpbridgeColor(sys1, sys2):
+    """ The color of a bridge only depends on its systems, so it stays the same across reloads
+    """
+    key = u"{0}-{1}".format(*sorted((sys1, sys2))).encode("utf-8")
+    return JB_COLORS[(zlib.crc32(key) & 0xffffffff) % len(JB_COLORS)]
 
 
 def convertRegionName(name):
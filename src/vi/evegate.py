@@ -17,28 +17,55 @@
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
+import bisect
 import datetime
-import json
 import time
 import six
 import requests
 import logging
 
-from six.moves import urllib
+from array import array
+from xml.etree import ElementTree
+
 from bs4 import BeautifulSoup
+from vi import httpclient
+from vi import pool
 from vi.cache.cache import Cache
+from vi.singleflight import flights
 
 ERROR = -1
 NOT_EXISTS = 0
 EXISTS = 1
 
+CHARACTER_ID_URL = "https://api.eveonline.com/eve/CharacterID.xml.aspx"
+CHARACTER_NAME_URL = "https://api.eveonline.com/eve/CharacterName.xml.aspx"
+CHARACTER_INFO_URL = "https://api.eveonline.com/eve/CharacterInfo.xml.aspx"
+JUMPS_URL = "https://api.eveonline.com/map/Jumps.xml.aspx"
+KILLS_URL = "https://api.eveonline.com/map/Kills.xml.aspx"
+PROFILE_URL = "https://gate.eveonline.com/Profile/"
+AVATAR_URL = "http://image.eveonline.com/Character/{id}_{size}.jpg"
+
+# Names or ids asked for in one request, bigger lists are split and fetched side by side
+CHUNK_SIZE = 100
+# How often a chunk with a broken answer is asked for again, and the seconds waited before
+CHUNK_RETRIES = 2
+CHUNK_RETRY_BACKOFF = 1.0
+# Failures the transport does not retry by itself, the connection ones were already retried by httpclient
+CHUNK_RETRY_TRANSPORT = (requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError)
+
+# Seconds the statistics stay current when the API says they did not change
+STATISTICS_RECHECK_SECS = 60 * 15
+
 
 def charnameToId(name):
     """ Uses the EVE API to convert a charname to his ID
     """
+    return flights().do(("charnameToId", name), _charnameToId, name)
+
+
+def _charnameToId(name):
     try:
-        url = "https://api.eveonline.com/eve/CharacterID.xml.aspx"
-        content = requests.get(url, params={'names': name}).text
+        content = httpclient.get(CHARACTER_ID_URL, params={'names': name}).text
         soup = BeautifulSoup(content, 'html.parser')
         rowSet = soup.select("rowset")[0]
         for row in rowSet.select("row"):
@@ -48,9 +75,7 @@ def charnameToId(name):
     except Exception as e:
         logging.error("Exception turning charname to id via API: %s", e)
         # fallback! if there is a problem with the API, we use evegate
-        baseUrl = "https://gate.eveonline.com/Profile/"
-
-        content = requests.get("{}{}".format(baseUrl, requests.utils.quote(name))).text
+        content = httpclient.get("{}{}".format(PROFILE_URL, requests.utils.quote(name))).text
         soup = BeautifulSoup(content, 'html.parser')
         img = soup.select("#imgActiveCharacter")
         imageUrl = soup.select("#imgActiveCharacter")[0]["src"]
@@ -65,36 +90,63 @@ def namesToIds(names):
     if len(names) == 0:
         return {}
     data = {}
-    apiCheckNames = set()
     cache = Cache()
 
     # do we have allready something in the cache?
-    for name in names:
-        cacheKey = "_".join(("id", "name", name))
-        id = cache.getFromCache(cacheKey)
+    cacheKeys = dict(("_".join(("id", "name", name)), name) for name in names)
+    for cacheKey, id in cache.getMany(cacheKeys).items():
         if id:
-            data[name] = id
-        else:
-            apiCheckNames.add(name)
+            data[cacheKeys[cacheKey]] = id
+    apiCheckNames = set(name for name in names if name not in data)
 
     try:
-        # not in cache? asking the EVE API
+        # not in cache? asking the EVE API, names another thread is asking for are shared
         if len(apiCheckNames) > 0:
-            url = "https://api.eveonline.com/eve/CharacterID.xml.aspx"
-            content = requests.get(url, params={'names': ','.join(apiCheckNames)}).text
-            soup = BeautifulSoup(content, 'html.parser')
-            rowSet = soup.select("rowset")[0]
-            for row in rowSet.select("row"):
-                data[row["name"]] = row["characterid"]
-            # writing the cache
-            for name in apiCheckNames:
-                cacheKey = "_".join(("id", "name", name))
-                cache.putIntoCache(cacheKey, data[name], 60 * 60 * 24 * 365)
+            data.update(flights().doMany("namesToIds", apiCheckNames, lambda names: _fetchChunked(_fetchIds, names)))
     except Exception as e:
         logging.error("Exception during namesToIds: %s", e)
     return data
 
 
+def _fetchChunked(fetch, items):
+    """ Splits items into chunks of CHUNK_SIZE, runs fetch(chunk) for them in the
+        worker pool and merges the dicts they return. A chunk with a broken answer
+        is retried on its own and left out if it keeps failing
+    """
+    items = list(items)
+    chunks = [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+    data = {}
+    fetchChunk = httpclient.carryPriority(lambda chunk: _fetchChunk(fetch, chunk))
+    for result in pool.parallelMap(fetchChunk, chunks, {}, httpclient.currentPriority()):
+        data.update(result)
+    return data
+
+
+def _fetchChunk(fetch, chunk):
+    for attempt in range(CHUNK_RETRIES + 1):
+        try:
+            return fetch(chunk)
+        except Exception as e:
+            retryable = isinstance(e, CHUNK_RETRY_TRANSPORT) or not isinstance(e, requests.exceptions.RequestException)
+            if not retryable or attempt == CHUNK_RETRIES:
+                raise
+            logging.warning("Retrying chunk of %d in %s: %s", len(chunk), fetch.__name__, e)
+            time.sleep(CHUNK_RETRY_BACKOFF * 2 ** attempt)
+
+
+def _fetchIds(names):
+    data = {}
+    content = httpclient.get(CHARACTER_ID_URL, params={'names': ','.join(names)}).text
+    soup = BeautifulSoup(content, 'html.parser')
+    rowSet = soup.select("rowset")[0]
+    for row in rowSet.select("row"):
+        data[row["name"]] = row["characterid"]
+    # writing the cache
+    Cache().putMany((("_".join(("id", "name", name)), data[name]) for name in names if name in data),
+                    60 * 60 * 24 * 365)
+    return data
+
+
 def idsToNames(ids):
     """ Returns the names for ids
         ids = iterable list of ids
@@ -103,48 +155,55 @@ def idsToNames(ids):
     data = {}
     if len(ids) == 0:
         return data
-    apiCheckIds = set()
     cache = Cache()
 
     # something allready in the cache?
-    for id in ids:
-        cacheKey = u"_".join(("name", "id", six.text_type(id)))
-        name = cache.getFromCache(cacheKey)
+    cacheKeys = dict((u"_".join(("name", "id", six.text_type(id))), id) for id in ids)
+    for cacheKey, name in cache.getMany(cacheKeys).items():
         if name:
-            data[id] = name
-        else:
-            apiCheckIds.add(six.text_type(id))
+            data[cacheKeys[cacheKey]] = name
+    apiCheckIds = set(six.text_type(id) for id in ids if id not in data)
 
     try:
         # call the EVE-Api for those entries we didn't have in the cache
-        url = "https://api.eveonline.com/eve/CharacterName.xml.aspx"
         if len(apiCheckIds) > 0:
-            content = requests.get(url, params={'ids': ','.join(apiCheckIds)}).text
-            soup = BeautifulSoup(content, 'html.parser')
-            rowSet = soup.select("rowset")[0]
-            for row in rowSet.select("row"):
-                data[row["characterid"]] = row["name"]
-            # and writing into cache
-            for id in apiCheckIds:
-                cacheKey = u"_".join(("name", "id", six.text_type(id)))
-                cache.putIntoCache(cacheKey, data[id], 60 * 60 * 24 * 365)
+            data.update(flights().doMany("idsToNames", apiCheckIds, lambda ids: _fetchChunked(_fetchNames, ids)))
     except Exception as e:
         logging.error("Exception during idsToNames: %s", e)
 
     return data
 
 
+def _fetchNames(ids):
+    data = {}
+    content = httpclient.get(CHARACTER_NAME_URL, params={'ids': ','.join(ids)}).text
+    soup = BeautifulSoup(content, 'html.parser')
+    rowSet = soup.select("rowset")[0]
+    for row in rowSet.select("row"):
+        data[row["characterid"]] = row["name"]
+    # and writing into cache
+    Cache().putMany(((u"_".join(("name", "id", id)), data[id]) for id in ids if id in data),
+                    60 * 60 * 24 * 365)
+    return data
+
+
 def getAvatarForPlayer(charname):
     """ Downlaoding th eavatar for a player/character
         charname = name of the character
         returns None if something gone wrong
     """
+    return flights().do(("avatar", charname), _getAvatarForPlayer, charname)
+
+
+def _getAvatarForPlayer(charname):
     avatar = None
     try:
-        charId = charnameToId(charname)
+        # the id is usually cached already (see PrefetchThread), unknown names come back as 0
+        charId = namesToIds([charname]).get(charname)
+        if not charId or int(charId) == 0:
+            charId = charnameToId(charname)
         if charId:
-            imageUrl = "http://image.eveonline.com/Character/{id}_{size}.jpg"
-            avatar = requests.get(imageUrl.format(id=charId, size=32)).content
+            avatar = httpclient.get(AVATAR_URL.format(id=charId, size=32)).content
     except Exception as e:
         logging.error("Exception during getAvatarForPlayer: %s", e)
         avatar = None
@@ -155,18 +214,16 @@ def checkPlayername(charname):
     """ Checking on evegate for an exiting playername
         returns 1 if exists, 0 if not and -1 if an error occured
     """
-    baseUrl = "https://gate.eveonline.com/Profile/"
-
-    queryCharname = utils.quote(charname)
-    url = baseUrl + queryCharname
+    queryCharname = requests.utils.quote(charname)
+    url = PROFILE_URL + queryCharname
     result = -1
 
     try:
-        urllib.request.urlopen(url)
-        result = 1
-    except urllib.error.HTTPError as e:
-        if ("404") in str(e):
+        status = httpclient.get(url).status_code
+        if status == 404:
             result = 0
+        elif status < 400:
+            result = 1
     except Exception as e:
         logging.error("Exception on checkPlayername: %s", e)
     return result
@@ -185,6 +242,10 @@ def eveEpoch():
 
 
 def getCharinfoForCharId(charId):
+    return flights().do(("charinfo", six.text_type(charId)), _getCharinfoForCharId, charId)
+
+
+def _getCharinfoForCharId(charId):
     cacheKey = u"_".join(("playerinfo_id_", six.text_type(charId)))
     cache = Cache()
     soup = cache.getFromCache(cacheKey)
@@ -193,8 +254,7 @@ def getCharinfoForCharId(charId):
     else:
         try:
             charId = int(charId)
-            url = "https://api.eveonline.com/eve/CharacterInfo.xml.aspx"
-            content = requests.get(url, params={'characterID': charId}).text
+            content = httpclient.get(CHARACTER_INFO_URL, params={'characterID': charId}).text
             soup = BeautifulSoup(content, 'html.parser')
             cacheUntil = datetime.datetime.strptime(soup.select("cacheduntil")[0].text, "%Y-%m-%d %H:%M:%S")
             diff = cacheUntil - currentEveTime()
@@ -218,73 +278,144 @@ def getCorpidsForCharId(charId):
     return data
 
 
-def getSystemStatistics():
-    """ Reads the informations for all solarsystems from the EVE API
-        Reads a dict like:
-            systemid: "jumps", "shipkills", "factionkills", "podkills"
+class SystemStatistics(object):
+    """ The statistics of some systems, kept in typed arrays sorted by system id.
+        Reads like a dict systemId -> {"jumps": .., "shipkills": .., "factionkills": .., "podkills": ..}
     """
-    data = {}
-    systemData = {}
-    cache = Cache()
-    # first the data for the jumps
-    cacheKey = "jumpstatistic"
-    jumpData = cache.getFromCache(cacheKey)
 
-    try:
-        if jumpData is None:
-            jumpData = {}
-            url = "https://api.eveonline.com/map/Jumps.xml.aspx"
-            content = requests.get(url).text
-            soup = BeautifulSoup(content, 'html.parser')
+    FIELDS = ("jumps", "shipkills", "factionkills", "podkills")
 
-            for result in soup.select("result"):
-                for row in result.select("row"):
-                    jumpData[int(row["solarsystemid"])] = int(row["shipjumps"])
+    def __init__(self, ids=None, columns=None):
+        self.ids = ids if ids is not None else array("i")
+        self.columns = columns if columns is not None else [array("i") for _ in self.FIELDS]
 
-            cacheUntil = datetime.datetime.strptime(soup.select("cacheduntil")[0].text, "%Y-%m-%d %H:%M:%S")
-            diff = cacheUntil - currentEveTime()
-            cache.putIntoCache(cacheKey, json.dumps(jumpData), diff.seconds)
-        else:
-            jumpData = json.loads(jumpData)
-
-        # now the further data
-        cacheKey = "systemstatistic"
-        systemData = cache.getFromCache(cacheKey)
-
-        if systemData is None:
-            systemData = {}
-            url = "https://api.eveonline.com/map/Kills.xml.aspx"
-            content = requests.get(url).text
-            soup = BeautifulSoup(content, 'html.parser')
+    def _index(self, systemId):
+        index = bisect.bisect_left(self.ids, systemId)
+        if index < len(self.ids) and self.ids[index] == systemId:
+            return index
+        return -1
 
-            for result in soup.select("result"):
-                for row in result.select("row"):
-                    systemData[int(row["solarsystemid"])] = {"ship": int(row["shipkills"]),
-                                                             "faction": int(row["factionkills"]),
-                                                             "pod": int(row["podkills"])}
+    def __contains__(self, systemId):
+        return self._index(systemId) >= 0
 
-            cacheUntil = datetime.datetime.strptime(soup.select("cacheduntil")[0].text, "%Y-%m-%d %H:%M:%S")
-            diff = cacheUntil - currentEveTime()
-            cache.putIntoCache(cacheKey, json.dumps(systemData), diff.seconds)
-        else:
-            systemData = json.loads(systemData)
+    def __getitem__(self, systemId):
+        index = self._index(systemId)
+        if index < 0:
+            raise KeyError(systemId)
+        return dict(zip(self.FIELDS, (column[index] for column in self.columns)))
+
+    def get(self, systemId, default=None):
+        return self[systemId] if systemId in self else default
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def keys(self):
+        return list(self.ids)
+
+    def items(self):
+        return [(systemId, self[systemId]) for systemId in self.ids]
+
+
+def parseMapRows(stream, attributes, systemIds=None):
+    """ Reads the rows of an EVE API map response (Jumps.xml, Kills.xml) from a
+        file like object with iterparse, without building the whole tree.
+        Returns (ids, columns, cachedUntil): the solarsystem ids, one int array
+        per attribute and the cachedUntil datetime. Rows of systems not in
+        systemIds are dropped while reading
+    """
+    ids = array("i")
+    columns = [array("i") for _ in attributes]
+    cachedUntil = None
+    rowset = None
+    for event, element in ElementTree.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if element.tag == "rowset":
+                rowset = element
+            continue
+        if element.tag == "row":
+            systemId = int(element.get("solarSystemID"))
+            if systemIds is None or systemId in systemIds:
+                ids.append(systemId)
+                for column, attribute in zip(columns, attributes):
+                    column.append(int(element.get(attribute, 0)))
+            # the rows are done with, keep the tree from growing
+            rowset.clear()
+        elif element.tag == "cachedUntil":
+            cachedUntil = datetime.datetime.strptime(element.text, "%Y-%m-%d %H:%M:%S")
+    return ids, columns, cachedUntil
+
+
+def _getMapRows(cacheKey, url, attributes, systemIds):
+    """ The rows of url for systemIds, from the cache if it holds all of them.
+        Returns a dict systemId -> tuple of the attributes
+    """
+    cache = Cache()
+    cached = cache.getValue(cacheKey)
+    if _coversSystems(cached, systemIds):
+        return dict(zip(cached["ids"], zip(*cached["columns"])))
+    # an outdated entry for the same systems is revalidated instead of downloaded again
+    if _coversSystems(cache.getValue(cacheKey, True), systemIds):
+        response = httpclient.refresh(url, cache, cacheKey, STATISTICS_RECHECK_SECS, stream=True)
+        if response is None:
+            cached = cache.getValue(cacheKey)
+            return dict(zip(cached["ids"], zip(*cached["columns"])))
+    else:
+        response = httpclient.get(url, stream=True)
+    try:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        ids, columns, cachedUntil = parseMapRows(response.raw, attributes, systemIds)
+    finally:
+        response.close()
+    if cachedUntil is not None:
+        diff = cachedUntil - currentEveTime()
+        etag, lastModified = httpclient.validatorsOf(response)
+        cache.putValue(cacheKey, {"ids": ids.tolist(), "columns": [column.tolist() for column in columns],
+                                  "systems": sorted(systemIds) if systemIds is not None else None},
+                       diff.seconds, etag, lastModified)
+    return dict(zip(ids, zip(*columns)))
+
+
+def _coversSystems(cached, systemIds):
+    """ True if cached, a value stored by _getMapRows, holds the rows of all systemIds
+    """
+    # older versions cached a plain dict, those entries are fetched again
+    if not isinstance(cached, dict) or "ids" not in cached:
+        return False
+    covered = cached["systems"]
+    return covered is None or (systemIds is not None and systemIds.issubset(covered))
+
+
+def getSystemStatistics(systemIds=None):
+    """ Reads the informations for the solarsystems in systemIds (all if None) from the EVE API
+        Returns a SystemStatistics, which reads like a dict:
+            systemid: "jumps", "shipkills", "factionkills", "podkills"
+    """
+    if systemIds is not None:
+        systemIds = set(int(systemId) for systemId in systemIds)
+    jumpData = {}
+    killData = {}
+    try:
+        jumpData = _getMapRows("jumpstatistic", JUMPS_URL, ("shipJumps",), systemIds)
+        killData = _getMapRows("systemstatistic", KILLS_URL, ("shipKills", "factionKills", "podKills"), systemIds)
     except Exception as e:
         logging.error("Exception during getSystemStatistics: : %s", e)
 
     # We collected all data (or loaded them from cache) - now zip it together
-    for i, v in jumpData.items():
-        i = int(i)
-        if i not in data:
-            data[i] = {"shipkills": 0, "factionkills": 0, "podkills": 0}
-        data[i]["jumps"] = v
-    for i, v in systemData.items():
-        i = int(i)
-        if i not in data:
-            data[i] = {"jumps": 0}
-        data[i]["shipkills"] = v["ship"] if "ship" in v else 0
-        data[i]["factionkills"] = v["faction"] if "faction" in v else 0
-        data[i]["podkills"] = v["pod"] if "pod" in v else 0
-    return data
+    statistics = SystemStatistics()
+    jumps, shipkills, factionkills, podkills = statistics.columns
+    for systemId in sorted(set(jumpData).union(killData)):
+        statistics.ids.append(systemId)
+        jumps.append(jumpData.get(systemId, (0,))[0])
+        ship, faction, pod = killData.get(systemId, (0, 0, 0))
+        shipkills.append(ship)
+        factionkills.append(faction)
+        podkills.append(pod)
+    return statistics
 
 
 def secondsTillDowntime():
@@ -0,0 +1,96 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+"""
+Runs the evegate lookups without blocking the calling thread. Every call
+returns a vi.pool.Future at once; the work is done by a few client threads,
+which bounds the requests in flight no matter how many workers submit.
+A call keeps the vi.httpclient priority of the thread submitting it, the
+interactive ones are taken from the queue first.
+The urls are the constants in vi.evegate, so a test can point them at a
+local server.
+"""
+
+import threading
+
+from vi import evegate
+from vi import httpclient
+from vi.pool import WorkerPool
+
+# Calls running at the same time, the others wait in the queue (and can be cancelled there)
+MAX_CONCURRENT = 6
+
+_client = None
+_clientLock = threading.Lock()
+
+
+class GateClient(object):
+
+    def __init__(self, maxConcurrent=MAX_CONCURRENT):
+        self.pool = WorkerPool(maxConcurrent, "GateClient")
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args):
+        """ Runs function(*args) in the client with the priority of the calling thread, returns a Future
+        """
+        future = self.pool.submitWithPriority(httpclient.currentPriority(), httpclient.carryPriority(function), *args)
+        with self._lock:
+            self._pending.add(future)
+        future.addDoneCallback(self._forget)
+        return future
+
+    def _forget(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def cancelAll(self):
+        """ Cancels every call which did not start yet
+        """
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.cancel()
+
+    def namesToIds(self, names):
+        return self.submit(evegate.namesToIds, names)
+
+    def idsToNames(self, ids):
+        return self.submit(evegate.idsToNames, ids)
+
+    def getCharinfoForCharId(self, charId):
+        return self.submit(evegate.getCharinfoForCharId, charId)
+
+    def getAvatarForPlayer(self, charname):
+        return self.submit(evegate.getAvatarForPlayer, charname)
+
+    def getSystemStatistics(self, systemIds=None):
+        return self.submit(evegate.getSystemStatistics, systemIds)
+
+
+def client():
+    """ The GateClient shared by the whole program, started on first use
+    """
+    global _client
+    if _client is None:
+        with _clientLock:
+            if _client is None:
+                _client = GateClient()
+    return _client
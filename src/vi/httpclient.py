@@ -0,0 +1,360 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+"""
+The one place where vintel talks HTTP. All requests share a session with a
+connection pool per host (keep-alive), default timeouts and a bounded number
+of retries with backoff. Every call is counted per endpoint.
+
+Every host has a token bucket limiting the requests per second, retries
+included, and a number of requests allowed at the same time. Requests made
+with interactive priority (see interactive()) get the tokens and the free
+slots before the background ones waiting for the same host.
+"""
+
+import contextlib
+import logging
+import re
+import threading
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    from requests.packages.urllib3.util.retry import Retry
+
+# Seconds to wait for the connection and between two bytes of the answer
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 20
+
+# Number of hosts with a pool and connections kept per host
+POOL_HOSTS = 10
+POOL_SIZE = 8
+
+# Requests running at the same time per host, the others wait
+HOST_CONCURRENCY = 4
+
+RETRIES = 3
+# Waits 0.5, 1, 2 seconds between the retries
+RETRY_BACKOFF = 0.5
+RETRY_STATUS = (500, 502, 503, 504)
+
+USER_AGENT = "vintel"
+
+# Requests per second and burst per host, hosts not listed get DEFAULT_RATE_LIMIT
+RATE_LIMITS = {"kos.cva-eve.org": (2.0, 6),
+               "api.eveonline.com": (8.0, 16),
+               "image.eveonline.com": (8.0, 16)}
+DEFAULT_RATE_LIMIT = (5.0, 10)
+
+# Priorities of requests, lower goes first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_client = None
+_clientLock = threading.Lock()
+_context = threading.local()
+
+
+def currentPriority():
+    """ The priority of requests made by the current thread, BACKGROUND if not set
+    """
+    return getattr(_context, "priority", BACKGROUND)
+
+
+@contextlib.contextmanager
+def priority(value):
+    """ Requests made by the current thread within the block have priority value
+    """
+    previous = currentPriority()
+    _context.priority = value
+    try:
+        yield
+    finally:
+        _context.priority = previous
+
+
+def interactive():
+    """ Requests within the block are for something the user is waiting for
+    """
+    return priority(INTERACTIVE)
+
+
+def carryPriority(function):
+    """ Returns function wrapped to run with the priority of the current thread,
+        for handing work to other threads
+    """
+    value = currentPriority()
+
+    def wrapper(*args, **kwargs):
+        with priority(value):
+            return function(*args, **kwargs)
+    wrapper.__name__ = getattr(function, "__name__", "wrapper")
+    return wrapper
+
+
+class TokenBucket(object):
+    """ Allows rate requests per second on average and burst at once. Callers of
+        a lower priority wait while one of a higher priority is waiting
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self._waiting = [0, 0]
+        self._condition = threading.Condition()
+
+    def acquire(self, priority=BACKGROUND):
+        """ Takes a token, waits until there is one. Returns the seconds waited
+        """
+        started = time.time()
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.time()
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    first = not any(self._waiting[:priority])
+                    if first and self.tokens >= 1:
+                        self.tokens -= 1
+                        return now - started
+                    # without a token wait for the next one, else for the higher priority to take its own
+                    self._condition.wait((1 - self.tokens) / self.rate if self.tokens < 1 else 0.05)
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+
+class HostSlots(object):
+    """ Allows count requests at the same time. Like TokenBucket, callers of a
+        lower priority wait while one of a higher priority is waiting
+    """
+
+    def __init__(self, count):
+        self.free = count
+        self._waiting = [0, 0]
+        self._condition = threading.Condition()
+
+    def acquire(self, priority=BACKGROUND):
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while self.free < 1 or any(self._waiting[:priority]):
+                    self._condition.wait()
+                self.free -= 1
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            self.free += 1
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def held(self, priority=BACKGROUND):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class LimitedRetry(Retry):
+    """ Takes a token of the bucket of the request before every retry, urllib3 retries
+        within the adapter and would pass the rate limit otherwise
+    """
+
+    def increment(self, *args, **kwargs):
+        # raises when the retries are used up, only a retry gets here
+        retry = super(LimitedRetry, self).increment(*args, **kwargs)
+        limiter = getattr(_context, "limiter", None)
+        if limiter is not None:
+            bucket, priority, waited = limiter
+            waited.append(bucket.acquire(priority))
+        return retry
+
+
+def _retry():
+    kwargs = dict(total=RETRIES, connect=RETRIES, read=RETRIES, backoff_factor=RETRY_BACKOFF,
+                  status_forcelist=RETRY_STATUS, raise_on_status=False)
+    try:
+        return LimitedRetry(**kwargs)
+    except TypeError:
+        # urllib3 before 1.16 knows no raise_on_status
+        del kwargs["raise_on_status"]
+        return LimitedRetry(**kwargs)
+
+
+def hostOf(url):
+    match = re.match(r"^\w+://([^/?#]*)", url)
+    return match.group(1).lower() if match else ""
+
+
+def endpointOf(url):
+    """ The name an url is counted under: host and path, numbers replaced
+    """
+    match = re.match(r"^\w+://([^/?#]*)([^?#]*)", url)
+    if not match:
+        return url
+    return match.group(1) + re.sub(r"\d+", "N", match.group(2))
+
+
+class HttpClient(object):
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, max_retries=_retry())
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._metrics = {}
+        self._metricsLock = threading.Lock()
+        self._hostSlots = {}
+        self._buckets = {}
+
+    def get(self, url, params=None, timeout=None, **kwargs):
+        """ Like requests.get, through the shared session. timeout defaults to
+            (CONNECT_TIMEOUT, READ_TIMEOUT)
+        """
+        if timeout is None:
+            timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        host = hostOf(url)
+        priority = currentPriority()
+        bucket = self._bucket(host)
+        waited = [bucket.acquire(priority)]
+        with self._hostSlot(host).held(priority):
+            started = time.time()
+            # the retries of the adapter run in this thread, see LimitedRetry
+            _context.limiter = (bucket, priority, waited)
+            try:
+                response = self.session.get(url, params=params, timeout=timeout, **kwargs)
+            except requests.exceptions.RequestException:
+                self._record(url, time.time() - started, None, 0, sum(waited))
+                raise
+            finally:
+                _context.limiter = None
+        size = 0 if kwargs.get("stream") else len(response.content)
+        self._record(url, time.time() - started, response.status_code, size, sum(waited))
+        return response
+
+    def _bucket(self, host):
+        with self._metricsLock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(*RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT))
+        return bucket
+
+    def _hostSlot(self, host):
+        with self._metricsLock:
+            slot = self._hostSlots.get(host)
+            if slot is None:
+                slot = self._hostSlots[host] = HostSlots(HOST_CONCURRENCY)
+        return slot
+
+    def _record(self, url, duration, status, size, waited=0.0):
+        endpoint = endpointOf(url)
+        with self._metricsLock:
+            entry = self._metrics.get(endpoint)
+            if entry is None:
+                entry = self._metrics[endpoint] = {"requests": 0, "errors": 0, "bytes": 0, "total_secs": 0.0,
+                                                   "max_secs": 0.0, "throttled_secs": 0.0, "status": {}}
+            entry["requests"] += 1
+            entry["throttled_secs"] += waited
+            entry["bytes"] += size
+            entry["total_secs"] += duration
+            entry["max_secs"] = max(entry["max_secs"], duration)
+            if status is None or status >= 400:
+                entry["errors"] += 1
+            if status is not None:
+                entry["status"][status] = entry["status"].get(status, 0) + 1
+
+    def metrics(self):
+        """ Returns a dict endpoint -> requests, errors, bytes, total_secs, max_secs, throttled_secs, status counts
+        """
+        with self._metricsLock:
+            return dict((endpoint, dict(entry, status=dict(entry["status"])))
+                        for endpoint, entry in self._metrics.items())
+
+    def logMetrics(self, level=logging.INFO):
+        for endpoint, entry in sorted(self.metrics().items()):
+            logging.log(level, "http %s: %d requests, %d errors, %d bytes, mean %.0fms, max %.0fms, "
+                        "throttled %.1fs, status %s",
+                        endpoint, entry["requests"], entry["errors"], entry["bytes"],
+                        entry["total_secs"] * 1000.0 / entry["requests"], entry["max_secs"] * 1000.0,
+                        entry["throttled_secs"], entry["status"])
+
+
+def client():
+    """ The HttpClient shared by the whole program
+    """
+    global _client
+    if _client is None:
+        with _clientLock:
+            if _client is None:
+                _client = HttpClient()
+    return _client
+
+
+def get(url, params=None, timeout=None, **kwargs):
+    return client().get(url, params=params, timeout=timeout, **kwargs)
+
+
+def validatorsOf(response):
+    """ The (etag, lastModified) headers of response, to be stored with the value made from it
+    """
+    return response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+
+def conditionalGet(url, validators=None, params=None, timeout=None, **kwargs):
+    """ A GET sending If-None-Match / If-Modified-Since for validators, the
+        (etag, lastModified) of a cached copy. Status 304 means the copy is current
+    """
+    etag, lastModified = validators or (None, None)
+    headers = dict(kwargs.pop("headers", None) or {})
+    if etag:
+        headers["If-None-Match"] = etag
+    if lastModified:
+        headers["If-Modified-Since"] = lastModified
+    return get(url, params=params, timeout=timeout, headers=headers, **kwargs)
+
+
+def refresh(url, cache, cacheKey, maxAge, params=None, deferred=False, **kwargs):
+    """ Asks url if the value cached under cacheKey changed. Returns None if not: the
+        cached value is current again for maxAge seconds (read it with outdated=True,
+        maxAge may be 0). Otherwise the response is returned, the caller stores what
+        it makes of it with validatorsOf(response). deferred leaves the cache write
+        to the background writer, for calls from the UI thread
+    """
+    response = conditionalGet(url, cache.getValidators(cacheKey), params=params, **kwargs)
+    if response.status_code == 304:
+        response.close()
+        extend = cache.extendDeferred if deferred else cache.extend
+        if extend(cacheKey, maxAge):
+            return None
+        # the cached value is gone meanwhile
+        response = get(url, params=params, **kwargs)
+    return response
@@ -22,6 +22,9 @@ import logging
 import requests
 
 from vi import evegate
+from vi import httpclient
+from vi import pool
+from vi.singleflight import flights
 
 UNKNOWN = "No Result"
 NOT_KOS = 'Not Kos'
@@ -31,13 +34,20 @@ CVA_KOS_URL = "http://kos.cva-eve.org/api/"
 
 
 def check(parts):
+    """ Checks the names in parts, the same check running in another thread is shared
+    """
+    names = tuple(sorted(set(name.strip() for name in parts)))
+    return flights().do(("kos", names), _check, names)
+
+
+def _check(parts):
     data = {}
     checkBylastChars = []
     namesAsIds = {}
     names = [name.strip() for name in parts]
 
     try:
-        kosData = requests.get(CVA_KOS_URL, params = {'c': 'json', 'type': 'multi', 'q': ','.join(names)}).json()
+        kosData = httpclient.get(CVA_KOS_URL, params = {'c': 'json', 'type': 'multi', 'q': ','.join(names)}).json()
     except requests.exceptions.RequestException as e:
         kosData = None
         logging.error("Error on pilot KOS check request %s", str(e))
@@ -73,8 +83,12 @@ def check(parts):
 
     # Anything left - do the corp check and fill in kos status
     if namesAsIds:
-        for name, id in namesAsIds.items():
-            corpCheckData[name] = {"id": id, "need_check": False, "corpids": evegate.getCorpidsForCharId(id)}
+        # The corporation histories are fetched side by side
+        namesAndIds = list(namesAsIds.items())
+        corpidsList = pool.parallelMap(httpclient.carryPriority(evegate.getCorpidsForCharId),
+                                       [id for name, id in namesAndIds], [], httpclient.currentPriority())
+        for (name, id), corpids in zip(namesAndIds, corpidsList):
+            corpCheckData[name] = {"id": id, "need_check": False, "corpids": corpids}
 
         corpIds = set()
         for name in namesAsIds.keys():
@@ -90,23 +104,9 @@ def check(parts):
                     nameData["corp_to_check"] = corpname
                     break
 
-        corpsToCheck = set([nameData["corp_to_check"] for nameData in corpCheckData.values() if nameData["need_check"] == True])
-        corpsResult = {}
-
-        for corp in corpsToCheck:
-            try:
-                kosData = requests.get(CVA_KOS_URL, params = { 'c': 'json', 'type': 'unit', 'q': corp }).json()
-            except requests.exceptions.RequestException as e:
-                logging.error("Error on corp KOS check request: %s", str(e))
-
-            kosResult = False
-
-            for result in kosData["results"]:
-                if result["kos"] == True:
-                    kosResult = True
-                elif "alliance" in result and result["alliance"]["kos"] == True:
-                    kosResult = True
-            corpsResult[corp] = kosResult
+        corpsToCheck = list(set([nameData["corp_to_check"] for nameData in corpCheckData.values() if nameData["need_check"] == True]))
+        corpsResult = dict(zip(corpsToCheck, pool.parallelMap(httpclient.carryPriority(corpIsKos), corpsToCheck,
+                                                              False, httpclient.currentPriority())))
 
         for charname, nameData in corpCheckData.items():
             if not nameData["need_check"]:
@@ -119,6 +119,29 @@ def check(parts):
     return data
 
 
+def corpIsKos(corp):
+    """ Asks CVA if the corporation or its alliance is KOS
+    """
+    return flights().do(("corpIsKos", corp), _corpIsKos, corp)
+
+
+def _corpIsKos(corp):
+    try:
+        kosData = httpclient.get(CVA_KOS_URL, params = { 'c': 'json', 'type': 'unit', 'q': corp }).json()
+    except requests.exceptions.RequestException as e:
+        logging.error("Error on corp KOS check request: %s", str(e))
+        return False
+
+    kosResult = False
+
+    for result in kosData["results"]:
+        if result["kos"] == True:
+            kosResult = True
+        elif "alliance" in result and result["alliance"]["kos"] == True:
+            kosResult = True
+    return kosResult
+
+
 def resultToText(results, onlyKos=False):
     groups = {}
     paragraphs = []
@@ -0,0 +1,233 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+"""
+A small pool of worker threads shared by the program, used to run blocking
+network calls side by side. Queued calls run by priority, lower first, and
+in the order they came within one priority.
+"""
+
+import itertools
+import logging
+import threading
+
+from six.moves import queue
+
+MAX_WORKERS = 8
+DEFAULT_PRIORITY = 1
+
+_pool = None
+_poolLock = threading.Lock()
+
+
+class _Batch(object):
+    """ The results of one parallelMap call and a countdown of the open tasks
+    """
+
+    def __init__(self, count, default):
+        self.results = [default] * count
+        self.open = count
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        if not count:
+            self.done.set()
+
+    def finish(self, index, result):
+        self.results[index] = result
+        with self.lock:
+            self.open -= 1
+            if not self.open:
+                self.done.set()
+
+
+class CancelledError(Exception):
+    pass
+
+
+class Future(object):
+    """ The result of a call submitted to a WorkerPool
+    """
+
+    PENDING, RUNNING, FINISHED, CANCELLED = range(4)
+
+    def __init__(self):
+        self.state = Future.PENDING
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def cancel(self):
+        """ Cancels the call if it did not start yet, returns True if it is cancelled
+        """
+        with self._lock:
+            if self.state == Future.CANCELLED:
+                return True
+            if self.state != Future.PENDING:
+                return False
+            self.state = Future.CANCELLED
+        self._finish()
+        return True
+
+    def cancelled(self):
+        return self.state == Future.CANCELLED
+
+    def done(self):
+        return self.state in (Future.FINISHED, Future.CANCELLED)
+
+    def result(self, timeout=None):
+        """ Waits for the call and returns its result or raises its exception.
+            Raises CancelledError if it was cancelled and RuntimeError on timeout
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("timeout waiting for the result")
+        if self.state == Future.CANCELLED:
+            raise CancelledError()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        try:
+            self.result(timeout)
+        except CancelledError:
+            raise
+        except Exception as e:
+            return e
+        return None
+
+    def addDoneCallback(self, callback):
+        """ callback(future) is called when the future is done, in the thread which finished it
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        _runCallback(callback, self)
+
+    def _start(self):
+        with self._lock:
+            if self.state != Future.PENDING:
+                return False
+            self.state = Future.RUNNING
+            return True
+
+    def _setResult(self, result, exception=None):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self.state = Future.FINISHED
+        self._finish()
+
+    def _finish(self):
+        self._done.set()
+        with self._lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            _runCallback(callback, self)
+
+
+def _runCallback(callback, future):
+    try:
+        callback(future)
+    except Exception as e:
+        logging.error("Error in future callback: %s", e)
+
+
+class WorkerPool(object):
+
+    def __init__(self, workers=MAX_WORKERS, name="PoolWorker"):
+        self.queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._workerThreads = set()
+        for number in range(workers):
+            thread = threading.Thread(target=self._work, name="{0}-{1}".format(name, number))
+            thread.daemon = True
+            thread.start()
+            self._workerThreads.add(thread)
+
+    def _work(self):
+        while True:
+            priority, order, task = self.queue.get()
+            task()
+
+    def _put(self, priority, task):
+        self.queue.put((priority, next(self._order), task))
+
+    def submit(self, function, *args, **kwargs):
+        """ Runs function(*args, **kwargs) in the pool, returns a Future for the result
+        """
+        return self.submitWithPriority(DEFAULT_PRIORITY, function, *args, **kwargs)
+
+    def submitWithPriority(self, priority, function, *args, **kwargs):
+        """ Like submit, calls with a lower priority run before the queued ones with a higher
+        """
+        future = Future()
+
+        def task():
+            if not future._start():
+                return
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                future._setResult(None, e)
+            else:
+                future._setResult(result)
+
+        self._put(priority, task)
+        return future
+
+    def parallelMap(self, function, items, default=None, priority=DEFAULT_PRIORITY):
+        """ Returns [function(item) for item in items], the calls run in the pool.
+            A call raising an exception is logged and gives default
+        """
+        items = list(items)
+        if threading.current_thread() in self._workerThreads:
+            # Waiting for the pool inside the pool could use up all workers
+            return [_call(function, item, default) for item in items]
+        batch = _Batch(len(items), default)
+        for index, item in enumerate(items):
+            self._put(priority, lambda index=index, item=item: batch.finish(index, _call(function, item, default)))
+        batch.done.wait()
+        return batch.results
+
+
+def _call(function, item, default):
+    try:
+        return function(item)
+    except Exception as e:
+        logging.error("Error in %s(%r): %s", getattr(function, "__name__", function), item, e)
+        return default
+
+
+def pool():
+    """ The WorkerPool shared by the whole program, started on first use
+    """
+    global _pool
+    if _pool is None:
+        with _poolLock:
+            if _pool is None:
+                _pool = WorkerPool()
+    return _pool
+
+
+def parallelMap(function, items, default=None, priority=DEFAULT_PRIORITY):
+    return pool().parallelMap(function, items, default, priority)
@@ -0,0 +1,141 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+
+
+"""
+Single-flight: concurrent callers asking for the same (operation, argument)
+share one call. The first caller runs it, everybody arriving while it is in
+flight waits for and gets the same result (or exception). Nothing is kept
+once the call finished, caching stays the job of vi.cache.
+"""
+
+import threading
+
+_flights = None
+_flightsLock = threading.Lock()
+
+
+class _Call(object):
+    """ One call in flight and the callers waiting for it
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight(object):
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        """ Runs function(*args) unless a call for key is already in flight,
+            in which case its result is returned instead
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        if not leader:
+            return call.wait()
+        try:
+            call.result = function(*args)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            self._finish([(key, call)])
+        return call.result
+
+    def doMany(self, operation, arguments, function):
+        """ The batch version of do: function gets a list of the arguments
+            no other caller is fetching at the moment and returns a dict
+            argument -> value. The arguments in flight elsewhere are waited for.
+            Returns a dict with all values found, arguments without a value
+            are left out
+        """
+        own = {}
+        others = {}
+        with self._lock:
+            for argument in arguments:
+                key = (operation, argument)
+                call = self._calls.get(key)
+                if call is None:
+                    call = _Call()
+                    self._calls[key] = call
+                    own[argument] = call
+                else:
+                    others[argument] = call
+        results = {}
+        if own:
+            try:
+                values = function(list(own.keys()))
+            except Exception as e:
+                for call in own.values():
+                    call.error = e
+                raise
+            else:
+                for argument, call in own.items():
+                    call.result = values.get(argument)
+                results.update(values)
+            finally:
+                self._finish(((operation, argument), call) for argument, call in own.items())
+        for argument, call in others.items():
+            value = call.wait()
+            if value is not None:
+                results[argument] = value
+        return results
+
+    def inFlight(self):
+        """ Number of calls running at the moment
+        """
+        with self._lock:
+            return len(self._calls)
+
+    def _finish(self, calls):
+        calls = list(calls)
+        with self._lock:
+            for key, call in calls:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+        for key, call in calls:
+            call.event.set()
+
+
+def flights():
+    """ The SingleFlight shared by the whole program
+    """
+    global _flights
+    if _flights is None:
+        with _flightsLock:
+            if _flights is None:
+                _flights = SingleFlight()
+    return _flights
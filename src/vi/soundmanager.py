@@ -27,6 +27,7 @@ import time
 from collections import namedtuple
 from PyQt4.QtCore import QThread
 from .resources import resourcePath
+from vi import httpclient
 from six.moves import queue
 
 import logging
@@ -172,7 +173,7 @@ class SoundManager:
             try:
                 mp3url = 'http://api.voicerss.org/?c=WAV&key={self.VOICE_RSS_API_KEY}&src={inputText}&hl=en-us'.format(
                     **locals())
-                self.playAudioFile(requests.get(mp3url, stream=True).raw)
+                self.playAudioFile(httpclient.get(mp3url, stream=True).raw)
                 time.sleep(.5)
             except requests.exceptions.RequestException as e:
                 logging.error('playTTS error: %s', str(e))
@@ -203,7 +204,7 @@ class SoundManager:
                 sys.stdout.flush()
                 if len(val) > 0:
                     try:
-                        args.timeout.write(requests.get(mp3url, headers=headers).content)
+                        args.timeout.write(httpclient.get(mp3url, headers=headers).content)
                         time.sleep(.5)
                     except requests.exceptions.RequestException as e:
                         logging.error('audioExtractToMp3 error: %s', e)
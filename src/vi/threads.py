@@ -19,18 +19,33 @@
 
 import time
 import logging
+import threading
+import six
 
+from collections import OrderedDict
 from six.moves import queue
 from PyQt4 import QtCore
 from PyQt4.QtCore import QThread
 from PyQt4.QtCore import SIGNAL
 from vi import evegate
+from vi import gateclient
+from vi import httpclient
 from vi import koschecker
 from vi.cache.cache import Cache
 from vi.resources import resourcePath
 
 STATISTICS_UPDATE_INTERVAL_MSECS = 1 * 60 * 1000
 
+
+class _Finished(object):
+    """ Put into the queue of a thread when a call it submitted to the gate client is done
+    """
+
+    def __init__(self, context, future):
+        self.context = context
+        self.future = future
+
+
 class AvatarFindThread(QThread):
 
     def __init__(self):
@@ -52,12 +67,13 @@ class AvatarFindThread(QThread):
 
     def run(self):
         cache = Cache()
-        lastCall = 0
-        wait = 300  # time between 2 requests in ms
         while True:
             try:
-                # Block waiting for addChatEntry() to enqueue something
+                # Block waiting for addChatEntry() or a finished download to enqueue something
                 chatEntry = self.queue.get()
+                if isinstance(chatEntry, _Finished):
+                    self.downloadFinished(cache, chatEntry.context, chatEntry.future)
+                    continue
                 charname = chatEntry.message.user
                 logging.debug("AvatarFindThread getting avatar for %s" % charname)
                 avatar = None
@@ -69,19 +85,27 @@ class AvatarFindThread(QThread):
                     if avatar:
                         logging.debug("AvatarFindThread found cached avatar for %s" % charname)
                 if not avatar:
-                    diffLastCall = time.time() - lastCall
-                    if diffLastCall < wait:
-                        time.sleep((wait - diffLastCall) / 1000.0)
-                    avatar = evegate.getAvatarForPlayer(charname)
-                    lastCall = time.time()
-                    if avatar:
-                        cache.putAvatar(charname, avatar)
+                    # The download runs in the gate client (rate limited by vi.httpclient as a background
+                    # request), the result comes back through the queue
+                    future = gateclient.client().getAvatarForPlayer(charname)
+                    future.addDoneCallback(lambda future, chatEntry=chatEntry: self.queue.put(_Finished(chatEntry, future)))
+                    continue
                 if avatar:
                     logging.debug("AvatarFindThread emit avatar_update for %s" % charname)
                     self.emit(SIGNAL("avatar_update"), chatEntry, avatar)
             except Exception as e:
                 logging.error("Error in AvatarFindThread : %s", e)
 
+    def downloadFinished(self, cache, chatEntry, future):
+        if future.cancelled():
+            return
+        charname = chatEntry.message.user
+        avatar = future.result()
+        if avatar:
+            cache.putAvatar(charname, avatar)
+            logging.debug("AvatarFindThread emit avatar_update for %s" % charname)
+            self.emit(SIGNAL("avatar_update"), chatEntry, avatar)
+
 
 class KOSCheckerThread(QThread):
 
@@ -109,14 +133,24 @@ class KOSCheckerThread(QThread):
 
     def run(self):
         while True:
-            # Block waiting for addRequest() to enqueue something
-            names, requestType, onlyKos = self.queue.get()
+            # Block waiting for addRequest() or a finished check to enqueue something
+            item = self.queue.get()
+            if not isinstance(item, _Finished):
+                names, requestType, onlyKos = item
+                if names:
+                    # The check runs in the gate client, several requests are checked side by side.
+                    # The user waits for it, so its requests go before the avatars and statistics
+                    with httpclient.interactive():
+                        future = gateclient.client().submit(koschecker.check, names)
+                    future.addDoneCallback(lambda future, item=item: self.queue.put(_Finished(item, future)))
+                continue
+            names, requestType, onlyKos = item.context
             try:
                 #logging.info("KOSCheckerThread kos checking %s" %  str(names))
                 hasKos = False
-                if not names:
+                if item.future.cancelled():
                     continue
-                checkResult = koschecker.check(names)
+                checkResult = item.future.result()
                 if not checkResult:
                     continue
                 text = koschecker.resultToText(checkResult, onlyKos)
@@ -137,10 +171,16 @@ class MapStatisticsThread(QThread):
 
     def __init__(self):
         QThread.__init__(self)
-        self.queue = queue.Queue(maxsize=1)
+        self.queue = queue.Queue()
         self.lastStatisticsUpdate = time.time()
         self.pollRate = STATISTICS_UPDATE_INTERVAL_MSECS
         self.refreshTimer = None
+        self.systemIds = None
+
+    def setSystemIds(self, systemIds):
+        """ Only the statistics of these systems (the ones on the map) are read
+        """
+        self.systemIds = frozenset(systemIds)
 
     def requestStatistics(self):
         self.queue.put(1)
@@ -148,19 +188,200 @@ class MapStatisticsThread(QThread):
     def run(self):
         self.refreshTimer = QtCore.QTimer()
         self.connect(self.refreshTimer, QtCore.SIGNAL("timeout()"), self.requestStatistics)
+        requesting = False
         while True:
-            # Block waiting for requestStatistics() to enqueue a token
-            self.queue.get()
-            self.refreshTimer.stop()
-            logging.debug("MapStatisticsThread requesting statistics")
+            # Block waiting for requestStatistics() or the finished request to enqueue something
+            item = self.queue.get()
+            if not isinstance(item, _Finished):
+                # a token coming in while a request runs is answered by that request
+                if not requesting:
+                    requesting = True
+                    self.refreshTimer.stop()
+                    logging.debug("MapStatisticsThread requesting statistics")
+                    future = gateclient.client().getSystemStatistics(self.systemIds)
+                    future.addDoneCallback(lambda future: self.queue.put(_Finished(None, future)))
+                continue
+            requesting = False
+            if item.future.cancelled():
+                continue
             try:
-                statistics = evegate.getSystemStatistics()
-                #time.sleep(2)  # sleeping to prevent a "need 2 arguments"-error
+                statistics = item.future.result()
                 requestData = {"result": "ok", "statistics": statistics}
             except Exception as e:
                 logging.error("Error in MapStatisticsThread: %s", e)
-                requestData = {"result": "error", "text": unicode(e)}
+                requestData = {"result": "error", "text": six.text_type(e)}
             self.lastStatisticsUpdate = time.time()
             self.refreshTimer.start(self.pollRate)
             self.emit(SIGNAL("statistic_data_update"), requestData)
             logging.debug("MapStatisticsThread emitted statistic_data_update")
+
+
+class PrefetchThread(QThread):
+    """
+        Looks up pilots before somebody asks for them: the ids and avatars of the
+        posters in the chats, the ids and character infos of the names in KOS
+        requests. A name is taken once per SEEN_SECS and at most BUDGET_PER_MINUTE
+        names a minute, the others are dropped. Start it with a low priority, its
+        requests are background ones and wait for the interactive.
+    """
+
+    POSTER, KOS = range(2)
+    IGNORED_NAMES = ("EVE-System", "EVE System", "VINTEL")
+
+    QUEUE_SIZE = 500
+    # Names looked up together, waiting at most BATCH_WAIT_SECS for the batch to fill
+    BATCH_SIZE = 50
+    BATCH_WAIT_SECS = 2
+    BUDGET_PER_MINUTE = 60
+    SEEN_SECS = 60 * 60
+    SEEN_LIMIT = 5000
+
+    def __init__(self):
+        QThread.__init__(self)
+        self.queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.active = True
+        # only used by the thread adding names
+        self.seen = OrderedDict()
+        self.budgetStart = 0
+        self.budgetUsed = 0
+
+    def addPosters(self, names):
+        self._add(names, self.POSTER)
+
+    def addKosNames(self, names):
+        self._add(names, self.KOS)
+
+    def _add(self, names, kind):
+        now = time.time()
+        for name in names:
+            name = name.strip()
+            if not name or name in self.IGNORED_NAMES:
+                continue
+            seen = self.seen.get(name)
+            if seen is not None and now - seen < self.SEEN_SECS:
+                continue
+            if now - self.budgetStart >= 60:
+                self.budgetStart = now
+                self.budgetUsed = 0
+            if self.budgetUsed >= self.BUDGET_PER_MINUTE:
+                logging.debug("PrefetchThread budget used up, dropping %s", name)
+                return
+            try:
+                self.queue.put_nowait((kind, name))
+            except queue.Full:
+                return
+            self.budgetUsed += 1
+            self.seen.pop(name, None)
+            self.seen[name] = now
+            while len(self.seen) > self.SEEN_LIMIT:
+                self.seen.popitem(last=False)
+
+    def run(self):
+        cache = Cache()
+        try:
+            while self.active:
+                batch = [self.queue.get()]
+                deadline = time.time() + self.BATCH_WAIT_SECS
+                while len(batch) < self.BATCH_SIZE:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self.queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                batch = [item for item in batch if item is not None]
+                try:
+                    if batch and self.active:
+                        self.prefetch(cache, batch)
+                except Exception as e:
+                    logging.error("Error in PrefetchThread: %s", e)
+        finally:
+            # The thread ends after quit(), its cache connection is not used again
+            Cache.CONNECTIONS.closeConnections()
+
+    def prefetch(self, cache, batch):
+        # one request for all the ids, they end up in the cache
+        ids = evegate.namesToIds(set(name for kind, name in batch))
+        posters = set(name for kind, name in batch if kind == self.POSTER)
+        for name in posters.difference(cache.getAvatars(posters)):
+            if not self.active:
+                return
+            avatar = evegate.getAvatarForPlayer(name)
+            if avatar:
+                cache.putAvatar(name, avatar)
+        for kind, name in batch:
+            if not self.active:
+                return
+            if kind == self.KOS and name in ids and int(ids[name]) != 0:
+                evegate.getCharinfoForCharId(ids[name])
+        logging.debug("PrefetchThread looked up %d names", len(batch))
+
+    def quit(self):
+        self.active = False
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        QThread.quit(self)
+
+
+class CacheSweeperThread(QThread):
+    """
+        Removes expired rows from the cache database in small batches and keeps
+        the database below Cache.MAX_DATABASE_SIZE. Start it with a low priority.
+    """
+
+    SWEEP_INTERVAL_SECS = 10 * 60
+    # Pause between two batches, so other writers get the database in between
+    BATCH_PAUSE_SECS = 0.2
+    # Free pages are given back every n-th sweep
+    VACUUM_EVERY_SWEEPS = 6
+
+    def __init__(self):
+        QThread.__init__(self)
+        self.active = True
+        # Set by quit(), ends the waits between sweeps and batches at once
+        self.stopping = threading.Event()
+
+    def run(self):
+        cache = Cache()
+        sweeps = 0
+        incremental = False
+        try:
+            while self.active:
+                try:
+                    self.sweep(cache)
+                    sweeps += 1
+                    if not incremental:
+                        # Tried after every sweep, a database too large for the switch may shrink below the limit
+                        incremental = cache.enableIncrementalVacuum()
+                    elif sweeps % self.VACUUM_EVERY_SWEEPS == 0:
+                        cache.incrementalVacuum()
+                except Exception as e:
+                    logging.error("Error in CacheSweeperThread: %s", e)
+                self.stopping.wait(self.SWEEP_INTERVAL_SECS)
+        finally:
+            # The thread ends after quit(), its cache connection is not used again
+            Cache.CONNECTIONS.closeConnections()
+
+    def sweep(self, cache):
+        deleted = 0
+        while self.active:
+            count = cache.deleteExpired()
+            deleted += count
+            if count < Cache.SWEEP_BATCH_SIZE:
+                break
+            self.stopping.wait(self.BATCH_PAUSE_SECS)
+        while self.active and Cache.MAX_DATABASE_SIZE and cache.databaseSize() > Cache.MAX_DATABASE_SIZE:
+            count = cache.deleteOldest()
+            deleted += count
+            if not count:
+                break
+            self.stopping.wait(self.BATCH_PAUSE_SECS)
+        logging.debug("CacheSweeperThread removed %d rows", deleted)
+
+    def quit(self):
+        self.active = False
+        self.stopping.set()
+        QThread.quit(self)
@@ -0,0 +1,464 @@
+###########################################################################
+#  Vintel - Visual Intel Chat Analyzer									  #
+#  Copyright (C) 2014-15 Sebastian Meyer (sparrow.242.de+eve@gmail.com )  #
+#																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+#																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+#																		  #
+#																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+import re
+import math
+import logging
+
+from collections import OrderedDict
+
+from PyQt4 import QtGui, QtCore
+from PyQt4.QtCore import SIGNAL
+
+MARKER_COLOR = "#462CFF"
+LOCATION_COLOR = "#8b008d"
+STATISTICS_COLOR = "blue"
+
+_STYLE_VALUE = re.compile(r"([\w-]+)\s*:\s*([^;]+)")
+_RGB_VALUE = re.compile(r"rgb\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)")
+_TRANSLATE_VALUE = re.compile(r"translate\(\s*([-\d.e]+)[\s,]+([-\d.e]+)\s*\)")
+
+
+def styleValue(style, name, default=None):
+    """ Returns the value of one property out of a svg style attribute
+    """
+    for key, value in _STYLE_VALUE.findall(style or ""):
+        if key == name:
+            return value.strip()
+    return default
+
+
+def toColor(value):
+    """ Converts a svg color value (#rrggbb, named or rgb(r,g,b)) to a QColor
+    """
+    match = _RGB_VALUE.match(value)
+    if match:
+        return QtGui.QColor(*[int(part) for part in match.groups()])
+    return QtGui.QColor(value)
+
+
+def parseTranslate(transform):
+    match = _TRANSLATE_VALUE.search(transform or "")
+    if not match:
+        return 0.0, 0.0
+    return float(match.group(1)), float(match.group(2))
+
+
+class _SystemItems(object):
+    """ The graphics items belonging to one system on the scene
+    """
+
+    def __init__(self, system):
+        self.system = system
+        self.rect = None
+        self.nameText = None
+        self.secondLine = None
+        self.secondLineCenter = None
+        self.location = None
+        self.statistics = None
+        self.statisticsCenter = None
+        # The last values applied to the items, to touch only what changed
+        self.fill = None
+        self.secondLineString = None
+        self.secondLineFill = None
+        self.located = None
+        self.statisticsString = None
+
+
+class StaticLayer(object):
+    """
+        Items which rarely change (jump lines, labels, bridges). They live in a
+        scene of their own which is rasterized once per zoom level; the pixmaps
+        are cached until the layer is invalidated.
+    """
+
+    MAX_CACHED_ZOOM_LEVELS = 4
+    MAX_PIXMAP_SIZE = 4096
+
+    def __init__(self):
+        self.scene = QtGui.QGraphicsScene()
+        self.scene.setItemIndexMethod(QtGui.QGraphicsScene.NoIndex)
+        self._pixmaps = OrderedDict()
+
+    def invalidate(self):
+        self._pixmaps.clear()
+
+    def pixmap(self, scale):
+        key = round(scale, 3)
+        pixmap = self._pixmaps.pop(key, None)
+        if pixmap is None:
+            pixmap = self._render(scale)
+        self._pixmaps[key] = pixmap
+        while len(self._pixmaps) > self.MAX_CACHED_ZOOM_LEVELS:
+            self._pixmaps.popitem(last=False)
+        return pixmap
+
+    def _render(self, scale):
+        rect = self.scene.sceneRect()
+        # Very high zoom levels are rendered at a lower resolution and scaled up
+        scale = min(scale, self.MAX_PIXMAP_SIZE / max(rect.width(), rect.height(), 1.0))
+        pixmap = QtGui.QPixmap(int(math.ceil(rect.width() * scale)), int(math.ceil(rect.height() * scale)))
+        pixmap.fill(QtCore.Qt.transparent)
+        painter = QtGui.QPainter(pixmap)
+        painter.setRenderHints(QtGui.QPainter.Antialiasing | QtGui.QPainter.TextAntialiasing)
+        self.scene.render(painter, QtCore.QRectF(pixmap.rect()), rect)
+        painter.end()
+        return pixmap
+
+    def draw(self, painter, scale):
+        pixmap = self.pixmap(scale)
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
+        painter.drawPixmap(self.scene.sceneRect(), pixmap, QtCore.QRectF(pixmap.rect()))
+
+
+class SceneMapRenderer(object):
+    """
+        Renders a dotlan.Map into a QGraphicsScene. The scene is built once,
+        update() only changes brushes, texts and visibility of existing items.
+        Static parts are composited from two cached layers: the base layer below
+        the scene items and the label layer on top of them. The scene itself only
+        holds the dynamic overlay: system fills, stopwatches, location ellipses
+        and the select marker.
+    """
+
+    NAME_FONT = ("Arial", 9, False)
+    SECOND_LINE_FONT = ("Verdana", 7, True)
+    STATISTICS_FONT = ("Arial", 8, False)
+
+    def __init__(self, dotlanMap):
+        self.map = dotlanMap
+        self.scene = QtGui.QGraphicsScene()
+        self.scene.setItemIndexMethod(QtGui.QGraphicsScene.NoIndex)
+        self.baseLayer = StaticLayer()
+        self.labelLayer = StaticLayer()
+        self.baseScale = 1.0
+        self.systemItems = {}
+        self._itemToSystem = {}
+        self._jumpbridgeItems = []
+        self._appliedJumpBridges = None
+        self._statisticsVisible = None
+        self._jumpbridgesVisible = None
+        self._markerTransform = None
+        self._build()
+
+    def _build(self):
+        self._addMarker()
+        self._addJumps()
+        for system in self.map.systems.values():
+            self._addSystem(system)
+        self._setSceneRect(self.map.soup.select("svg")[0])
+        self.update()
+
+    def _setSceneRect(self, svg):
+        try:
+            x, y, width, height = [float(part) for part in svg["viewbox"].replace(",", " ").split()]
+            rect = QtCore.QRectF(x, y, width, height)
+            self.baseScale = float(svg["width"]) / width
+        except (KeyError, ValueError) as e:
+            logging.debug("SceneMapRenderer: no usable viewBox, using item bounds (%s)", e)
+            # The marker's cross-hairs would blow up the bounds of the overlay scene
+            rect = self.baseLayer.scene.itemsBoundingRect().united(self.labelLayer.scene.itemsBoundingRect())
+        # All layers share the same coordinates, so the pixmaps can be drawn onto the scene rect
+        for scene in (self.scene, self.baseLayer.scene, self.labelLayer.scene):
+            scene.setSceneRect(rect)
+
+    def _font(self, definition):
+        family, pixelSize, bold = definition
+        font = QtGui.QFont(family)
+        font.setPixelSize(pixelSize)
+        font.setBold(bold)
+        return font
+
+    def _addText(self, scene, text, font, color, zValue):
+        item = QtGui.QGraphicsSimpleTextItem(text)
+        item.setFont(font)
+        item.setBrush(QtGui.QBrush(toColor(color)))
+        item.setZValue(zValue)
+        scene.addItem(item)
+        return item
+
+    def _centerText(self, item, center):
+        """ Places a text like svg with text-anchor:middle, center is the baseline point
+        """
+        bounds = item.boundingRect()
+        ascent = QtGui.QFontMetricsF(item.font()).ascent()
+        item.setPos(center[0] - bounds.width() / 2, center[1] - ascent)
+
+    def _addMarker(self):
+        pen = QtGui.QPen(toColor(MARKER_COLOR))
+        pen.setCosmetic(True)
+        self.marker = QtGui.QGraphicsItemGroup()
+        ellipse = QtGui.QGraphicsEllipseItem(-56, -28, 112, 56)
+        ellipse.setBrush(QtGui.QBrush(toColor(MARKER_COLOR)))
+        ellipse.setPen(QtGui.QPen(QtCore.Qt.NoPen))
+        self.marker.addToGroup(ellipse)
+        for x, y in ((0, -10000), (-10000, 0), (10000, 0), (0, 10000)):
+            line = QtGui.QGraphicsLineItem(x, y, 0, 0)
+            line.setPen(pen)
+            self.marker.addToGroup(line)
+        self.marker.setZValue(0)
+        self.marker.setVisible(False)
+        self.scene.addItem(self.marker)
+
+    def _addJumps(self):
+        jumps = self.map.soup.select("#jumps")[0]
+        for line in jumps.select("line"):
+            if "jumpbridge" in line.get("class", []):
+                continue
+            try:
+                coords = [float(line[key]) for key in ("x1", "y1", "x2", "y2")]
+            except (KeyError, ValueError):
+                continue
+            pen = QtGui.QPen(toColor(styleValue(line.get("style"), "stroke", "#000000")))
+            pen.setWidthF(float(styleValue(line.get("style"), "stroke-width", 1)))
+            item = self.baseLayer.scene.addLine(QtCore.QLineF(*coords), pen)
+            item.setZValue(3)
+
+    def _addSystem(self, system):
+        items = _SystemItems(system)
+        coords = system.mapCoordinates
+        offset = system.getTransformOffsetPoint()
+        originX = coords["x"] + offset[0]
+        originY = coords["y"] + offset[1]
+
+        rect = system.rect
+        path = QtGui.QPainterPath()
+        path.addRoundedRect(originX + float(rect["x"]), originY + float(rect["y"]), float(rect["width"]),
+                            float(rect["height"]), float(rect.get("rx", 0)), float(rect.get("ry", 0)))
+        items.rect = self.scene.addPath(path, QtGui.QPen(QtCore.Qt.black))
+        items.rect.setZValue(5)
+
+        texts = system.svgElement.select("text")
+        nameCenter = (originX + float(texts[0]["x"]), originY + float(texts[0]["y"]))
+        items.nameText = self._addText(self.labelLayer.scene, system.name, self._font(self.NAME_FONT), "#000000", 6)
+        self._centerText(items.nameText, nameCenter)
+        items.secondLineCenter = (originX + float(texts[1]["x"]), originY + float(texts[1]["y"]))
+        items.secondLine = self._addText(self.scene, u"", self._font(self.SECOND_LINE_FONT), "#000000", 6)
+
+        items.location = QtGui.QGraphicsEllipseItem(coords["center_x"] - 2.5 + offset[0] - (coords["width"] / 2 + 4),
+                                                    coords["center_y"] + offset[1] - (coords["height"] / 2 + 4),
+                                                    coords["width"] + 8, coords["height"] + 8)
+        items.location.setBrush(QtGui.QBrush(toColor(LOCATION_COLOR)))
+        items.location.setPen(QtGui.QPen(QtCore.Qt.NoPen))
+        items.location.setZValue(1)
+        items.location.setVisible(False)
+        self.scene.addItem(items.location)
+
+        items.statisticsCenter = (coords["center_x"] + offset[0], coords["y"] + coords["height"] + 6 + offset[1])
+        items.statistics = self._addText(self.baseLayer.scene, u"", self._font(self.STATISTICS_FONT),
+                                         STATISTICS_COLOR, 4)
+        items.statistics.setVisible(False)
+
+        self.systemItems[system.name] = items
+        for item in (items.rect, items.secondLine):
+            self._itemToSystem[item] = system
+
+    def _rebuildJumpbridges(self):
+        scene = self.baseLayer.scene
+        for item in self._jumpbridgeItems:
+            scene.removeItem(item)
+        self._jumpbridgeItems = []
+        for systemOne, connection, systemTwo, color in self.map.jumpBridges:
+            qcolor = toColor("#" + color)
+            pen = QtGui.QPen(qcolor)
+            pen.setWidthF(2)
+            for system in (systemOne, systemTwo):
+                coords = system.mapCoordinates
+                offset = system.getTransformOffsetPoint()
+                fill = QtGui.QColor(qcolor)
+                fill.setAlphaF(0.4)
+                marker = scene.addRect(coords["x"] - 3 + offset[0], coords["y"] + offset[1],
+                                            coords["width"] + 1.5, coords["height"], pen, QtGui.QBrush(fill))
+                marker.setZValue(2)
+                self._jumpbridgeItems.append(marker)
+            start = self._center(systemOne)
+            end = self._center(systemTwo)
+            line = scene.addLine(QtCore.QLineF(start, end), pen)
+            line.setZValue(2)
+            self._jumpbridgeItems.append(line)
+            if "<" in connection:
+                self._jumpbridgeItems.append(self._addArrow(end, start, qcolor))
+            if ">" in connection:
+                self._jumpbridgeItems.append(self._addArrow(start, end, qcolor))
+        self._appliedJumpBridges = self.map.jumpBridges
+        self._jumpbridgesVisible = None
+        self._invalidateBaseLayer()
+
+    def _invalidateBaseLayer(self):
+        self.baseLayer.invalidate()
+        self.scene.invalidate(self.scene.sceneRect(), QtGui.QGraphicsScene.BackgroundLayer)
+
+    def _center(self, system):
+        coords = system.mapCoordinates
+        offset = system.getTransformOffsetPoint()
+        return QtCore.QPointF(coords["center_x"] + offset[0], coords["center_y"] + offset[1])
+
+    def _addArrow(self, start, end, color):
+        """ A small arrow head pointing to end, set back so it is not hidden by the system
+        """
+        line = QtCore.QLineF(end, start)
+        if line.length() > 0:
+            line.setLength(min(30.0, line.length()))
+        tip = line.p2()
+        head = QtCore.QLineF(tip, end)
+        left = QtCore.QLineF(head)
+        left.setLength(10)
+        left.setAngle(head.angle() + 25)
+        right = QtCore.QLineF(head)
+        right.setLength(10)
+        right.setAngle(head.angle() - 25)
+        polygon = QtGui.QPolygonF([tip, left.p2(), right.p2()])
+        item = self.baseLayer.scene.addPolygon(polygon, QtGui.QPen(color), QtGui.QBrush(color))
+        item.setZValue(2)
+        return item
+
+    def systemAt(self, scenePos):
+        """ Returns the system under the scene position or None
+        """
+        for item in self.scene.items(scenePos):
+            system = self._itemToSystem.get(item)
+            if system is not None:
+                return system
+        return None
+
+    def update(self):
+        """ Brings the items of the systems in view up to date with the map model
+        """
+        self.map.update()
+        if self._appliedJumpBridges is not self.map.jumpBridges:
+            self._rebuildJumpbridges()
+        jumpbridgesVisible = self.map._jumpMapsVisible
+        if jumpbridgesVisible != self._jumpbridgesVisible:
+            for item in self._jumpbridgeItems:
+                item.setVisible(jumpbridgesVisible)
+            self._jumpbridgesVisible = jumpbridgesVisible
+            self._invalidateBaseLayer()
+        statisticsVisible = self.map.statisticsShown()
+        baseChanged = False
+        if statisticsVisible != self._statisticsVisible:
+            for items in self.systemItems.values():
+                items.statistics.setVisible(statisticsVisible)
+            self._statisticsVisible = statisticsVisible
+            baseChanged = True
+        for system in self.map.visibleSystems:
+            baseChanged = self._updateSystem(self.systemItems[system.name], statisticsVisible) or baseChanged
+        if baseChanged:
+            self._invalidateBaseLayer()
+        self._updateMarker()
+
+    def _updateSystem(self, items, statisticsVisible):
+        """ Updates the overlay items of one system, returns True if the base layer changed
+        """
+        baseChanged = False
+        system = items.system
+        fill = styleValue(system.rect.get("style"), "fill")
+        if fill != items.fill:
+            items.rect.setBrush(QtGui.QBrush(toColor(fill)) if fill else QtGui.QBrush())
+            items.fill = fill
+        secondLineString = system.secondLine.string or u""
+        if secondLineString != items.secondLineString:
+            items.secondLine.setText(secondLineString)
+            self._centerText(items.secondLine, items.secondLineCenter)
+            items.secondLineString = secondLineString
+        secondLineFill = styleValue(system.secondLine.get("style"), "fill", "#000000")
+        if secondLineFill != items.secondLineFill:
+            items.secondLine.setBrush(QtGui.QBrush(toColor(secondLineFill)))
+            items.secondLineFill = secondLineFill
+        located = bool(system.getLocatedCharacters())
+        if located != items.located:
+            items.location.setVisible(located)
+            items.located = located
+        if statisticsVisible:
+            if system.statisticsText != items.statisticsString:
+                items.statistics.setText(system.statisticsText)
+                self._centerText(items.statistics, items.statisticsCenter)
+                items.statisticsString = system.statisticsText
+                baseChanged = True
+        return baseChanged
+
+    def _updateMarker(self):
+        marker = self.map.marker
+        opacity = float(marker["opacity"])
+        self.marker.setVisible(opacity > 0)
+        if opacity > 0:
+            self.marker.setOpacity(opacity)
+            transform = marker["transform"]
+            if transform != self._markerTransform:
+                self.marker.setPos(*parseTranslate(transform))
+                self._markerTransform = transform
+
+
+class MapGraphicsView(QtGui.QGraphicsView):
+    """
+        The view for the SceneMapRenderer. Speaks the same zoom api as the
+        QWebView so both can be driven by the same controls.
+    """
+
+    def __init__(self, parent=None):
+        QtGui.QGraphicsView.__init__(self, parent)
+        self.renderer = None
+        self._zoomFactor = 1.0
+        self._pressPos = None
+        self.setRenderHints(QtGui.QPainter.Antialiasing | QtGui.QPainter.TextAntialiasing)
+        self.setViewportUpdateMode(QtGui.QGraphicsView.SmartViewportUpdate)
+        self.setDragMode(QtGui.QGraphicsView.ScrollHandDrag)
+        self.setBackgroundBrush(QtGui.QBrush(QtCore.Qt.white))
+
+    def drawBackground(self, painter, rect):
+        QtGui.QGraphicsView.drawBackground(self, painter, rect)
+        if self.renderer:
+            self.renderer.baseLayer.draw(painter, self.transform().m11())
+
+    def drawForeground(self, painter, rect):
+        QtGui.QGraphicsView.drawForeground(self, painter, rect)
+        if self.renderer:
+            self.renderer.labelLayer.draw(painter, self.transform().m11())
+
+    def setRenderer(self, renderer):
+        self.renderer = renderer
+        self.setScene(renderer.scene)
+        self.setZoomFactor(self._zoomFactor)
+
+    def zoomFactor(self):
+        return self._zoomFactor
+
+    def setZoomFactor(self, zoomFactor):
+        self._zoomFactor = zoomFactor
+        scale = zoomFactor * (self.renderer.baseScale if self.renderer else 1.0)
+        self.setTransform(QtGui.QTransform.fromScale(scale, scale))
+
+    def visibleMapRect(self):
+        """ The visible part of the map as (x, y, width, height) in map coordinates
+        """
+        rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        return rect.x(), rect.y(), rect.width(), rect.height()
+
+    def mousePressEvent(self, event):
+        self._pressPos = event.pos()
+        QtGui.QGraphicsView.mousePressEvent(self, event)
+
+    def mouseReleaseEvent(self, event):
+        QtGui.QGraphicsView.mouseReleaseEvent(self, event)
+        if not (self.renderer and event.button() == QtCore.Qt.LeftButton):
+            return
+        # A drag scrolls the map, only a click opens the system
+        if self._pressPos is not None and (event.pos() - self._pressPos).manhattanLength() < 4:
+            system = self.renderer.systemAt(self.mapToScene(event.pos()))
+            if system is not None:
+                self.emit(SIGNAL("system_clicked"), system.name)
@@ -21,7 +21,6 @@ import datetime
 import sys
 import time
 import six
-import requests
 import webbrowser
 
 import vi.version
@@ -32,13 +31,14 @@ from PyQt4 import Qt, QtGui, uic, QtCore
 from PyQt4.QtCore import QPoint
 from PyQt4.QtGui import QImage, QPixmap, QMessageBox
 from PyQt4.QtWebKit import QWebPage
-from vi import amazon_s3, evegate
+from vi import amazon_s3, evegate, gateclient, httpclient
 from vi import chatparser, dotlan, filewatcher
 from vi import states
 from vi.cache.cache import Cache
 from vi.resources import resourcePath
 from vi.soundmanager import SoundManager
-from vi.threads import AvatarFindThread, KOSCheckerThread, MapStatisticsThread
+from vi.threads import AvatarFindThread, CacheSweeperThread, KOSCheckerThread, MapStatisticsThread, PrefetchThread
+from vi.ui.maprenderer import MapGraphicsView, SceneMapRenderer
 from vi.ui.systemtray import TrayContextMenu
 
 # Timer intervals
@@ -77,6 +77,14 @@ class MainWindow(QtGui.QMainWindow):
         self.chatEntries = []
         self.frameButton.setVisible(False)
         self.scanIntelForKosRequestsEnabled = True
+        self.useNativeMapRenderer = False
+        self.dotlan = None
+        self.mapRenderer = None
+
+        # The native map view shares the place of the web view, only one of them is visible
+        self.nativeMapView = MapGraphicsView(self.mapwidget)
+        self.nativeMapView.setVisible(False)
+        self.verticalLayout.addWidget(self.nativeMapView)
 
         # Load user's toon names
         self.knownPlayerNames = self.cache.getFromCache("known_player_names")
@@ -93,7 +101,7 @@ class MainWindow(QtGui.QMainWindow):
             roomnames = roomnames.split(",")
         else:
             roomnames = (u"TheCitadel", u"North Provi Intel", u"North Catch Intel")
-            self.cache.putIntoCache("room_names", u",".join(roomnames), 60 * 60 * 24 * 365 * 5)
+            self.cache.putIntoCacheDeferred("room_names", u",".join(roomnames), 60 * 60 * 24 * 365 * 5)
         self.roomnames = roomnames
 
         # Disable the sound UI if sound is not available
@@ -160,6 +168,7 @@ class MainWindow(QtGui.QMainWindow):
         self.connect(self.chatLargeButton, Qt.SIGNAL("clicked()"), self.chatLarger)
         self.connect(self.chatSmallButton, Qt.SIGNAL("clicked()"), self.chatSmaller)
         self.connect(self.infoAction, Qt.SIGNAL("triggered()"), self.showInfo)
+        self.connect(self.logStatisticsAction, Qt.SIGNAL("triggered()"), self.logStatistics)
         self.connect(self.showChatAvatarsAction, Qt.SIGNAL("triggered()"), self.changeShowAvatars)
         self.connect(self.alwaysOnTopAction, Qt.SIGNAL("triggered()"), self.changeAlwaysOnTop)
         self.connect(self.chooseChatRoomsAction, Qt.SIGNAL("triggered()"), self.showChatroomChooser)
@@ -183,6 +192,10 @@ class MainWindow(QtGui.QMainWindow):
         self.connect(self.quitAction, Qt.SIGNAL("triggered()"), self.close)
         self.connect(self.trayIcon, Qt.SIGNAL("quit"), self.close)
         self.connect(self.jumpbridgeDataAction, Qt.SIGNAL("triggered()"), self.showJumbridgeChooser)
+        self.connect(self.nativeMapRendererAction, Qt.SIGNAL("triggered()"), self.changeNativeMapRenderer)
+        self.connect(self.nativeMapView, Qt.SIGNAL("system_clicked"), self.showSystemChat)
+        self.connect(self.nativeMapView.horizontalScrollBar(), Qt.SIGNAL("valueChanged(int)"), self.nativeMapScrolled)
+        self.connect(self.nativeMapView.verticalScrollBar(), Qt.SIGNAL("valueChanged(int)"), self.nativeMapScrolled)
 
 
     def setupThreads(self):
@@ -208,6 +221,13 @@ class MainWindow(QtGui.QMainWindow):
         self.statisticsThread.start()
         # statisticsThread is blocked until first call of requestStatistics
 
+        self.cacheSweeperThread = CacheSweeperThread()
+        self.cacheSweeperThread.start(QtCore.QThread.LowestPriority)
+
+        # Warms the cache with the pilots of the chats and KOS requests
+        self.prefetchThread = PrefetchThread()
+        self.prefetchThread.start(QtCore.QThread.LowestPriority)
+
 
     def setupMap(self, initialize=False):
         self.mapTimer.stop()
@@ -244,6 +264,11 @@ class MainWindow(QtGui.QMainWindow):
         self.setJumpbridges(self.cache.getFromCache("jumpbridge_url"))
         self.initMapPosition = None  # We read this after first rendering
         self.systems = self.dotlan.systems
+        self.statisticsThread.setSystemIds(self.dotlan.systemsById.keys())
+        self.dotlan.setClientSideAnimation(not self.useNativeMapRenderer)
+        self.mapRenderer = None
+        if self.useNativeMapRenderer:
+            self.setupMapRenderer()
         logging.critical("Creating chat parser")
         self.chatparser = chatparser.ChatParser(self.pathToLogs, self.roomnames, self.systems)
 
@@ -256,6 +281,7 @@ class MainWindow(QtGui.QMainWindow):
 
             self.mapView.contextMenu = TrayContextMenu(self.trayIcon)
             self.mapView.contextMenuEvent = mapContextMenuEvent
+            self.nativeMapView.contextMenuEvent = mapContextMenuEvent
             self.mapView.connect(self.mapView, Qt.SIGNAL("linkClicked(const QUrl&)"), self.mapLinkClicked)
 
             # Also set up our app menus
@@ -305,7 +331,7 @@ class MainWindow(QtGui.QMainWindow):
         # Known playernames
         if self.knownPlayerNames:
             value = ",".join(self.knownPlayerNames)
-            self.cache.putIntoCache("known_player_names", value, 60 * 60 * 24 * 365)
+            self.cache.putIntoCacheDeferred("known_player_names", value, 60 * 60 * 24 * 365)
 
         # Program state to cache (to read it on next startup)
         settings = ((None, "restoreGeometry", str(self.saveGeometry())), (None, "restoreState", str(self.saveState())),
@@ -324,19 +350,27 @@ class MainWindow(QtGui.QMainWindow):
                     (None, "changeFrameless", self.framelessWindowAction.isChecked()),
                     (None, "changeUseSpokenNotifications", self.useSpokenNotificationsAction.isChecked()),
                     (None, "changeKosCheckClipboard", self.kosClipboardActiveAction.isChecked()),
-                    (None, "changeAutoScanIntel", self.scanIntelForKosRequestsEnabled))
-        self.cache.putIntoCache("settings", str(settings), 60 * 60 * 24 * 365)
+                    (None, "changeAutoScanIntel", self.scanIntelForKosRequestsEnabled),
+                    (None, "changeNativeMapRenderer", self.useNativeMapRenderer))
+        self.cache.putSettings("settings", settings)
+        self.cache.flush()
 
         # Stop the threads
         try:
+            # Calls still queued in the gate client are not needed anymore
+            gateclient.client().cancelAll()
             self.avatarFindThread.quit()
             self.filewatcherThread.quit()
             self.kosRequestThread.quit()
-            self.self.statisticsThread.quit()
+            self.prefetchThread.quit()
+            self.statisticsThread.quit()
             self.versionCheckThread.quit()
+            self.cacheSweeperThread.quit()
             SoundManager().quit()
         except Exception:
             pass
+        # Everything is flushed, the connection of the GUI thread is done
+        Cache.CONNECTIONS.closeConnections()
         self.trayIcon.hide()
         event.accept()
 
@@ -398,6 +432,28 @@ class MainWindow(QtGui.QMainWindow):
             self.activateSoundAction.setChecked(newValue)
             SoundManager().soundActive = newValue
 
+    def changeNativeMapRenderer(self, newValue=None):
+        if newValue is None:
+            newValue = self.nativeMapRendererAction.isChecked()
+        self.nativeMapRendererAction.setChecked(newValue)
+        self.useNativeMapRenderer = newValue
+        self.nativeMapView.setZoomFactor(self.mapView.zoomFactor())
+        self.nativeMapView.setVisible(newValue)
+        self.mapView.setVisible(not newValue)
+        if self.dotlan is not None:
+            if newValue:
+                self.setupMapRenderer()
+            # The web view animates itself, the native renderer needs the clocks ticked by the map
+            self.dotlan.setClientSideAnimation(not newValue)
+            self.updateMapView()
+
+    def setupMapRenderer(self):
+        """ Builds the scene for the current map the first time the native renderer is used
+        """
+        if self.mapRenderer is None:
+            self.mapRenderer = SceneMapRenderer(self.dotlan)
+            self.nativeMapView.setRenderer(self.mapRenderer)
+
     def changeAlwaysOnTop(self, newValue=None):
         if newValue is None:
             newValue = self.alwaysOnTopAction.isChecked()
@@ -483,11 +539,15 @@ class MainWindow(QtGui.QMainWindow):
                 if not knownPlayers or part in knownPlayers:
                     self.trayIcon.setIcon(self.taskbarIconWorking)
                     self.kosRequestThread.addRequest(parts, "clipboard", True)
+                    self.prefetchThread.addKosNames(parts)
                     break
             self.oldClipboardContent = contentTuple
 
     def mapLinkClicked(self, url):
         systemName = six.text_type(url.path().split("/")[-1]).upper()
+        self.showSystemChat(systemName)
+
+    def showSystemChat(self, systemName):
         system = self.systems[str(systemName)]
         sc = SystemChat(self, SystemChat.SYSTEM, system, self.chatEntries, self.knownPlayerNames)
         sc.connect(self, Qt.SIGNAL("chat_message_added"), sc.addChatEntry)
@@ -504,7 +564,7 @@ class MainWindow(QtGui.QMainWindow):
             system.removeLocatedCharacter(char)
         if not newSystem == "?" and newSystem in self.systems:
             self.systems[newSystem].addLocatedCharacter(char)
-            self.setMapContent(self.dotlan.svg)
+            self.updateMapView()
 
     def setMapContent(self, content):
         if self.initMapPosition is None:
@@ -537,17 +597,13 @@ class MainWindow(QtGui.QMainWindow):
         if url is None:
             url = ""
         try:
-            data = []
             if url != "":
-                resp = requests.get(url)
-                for line in resp.iter_lines(decode_unicode=True):
-                    parts = line.strip().split()
-                    if len(parts) == 3:
-                        data.append(parts)
+                # revalidated on every load, so changes to the list show up at once
+                data = amazon_s3.fetchJumpbridgeData(url, "jb_url_" + url, 0)
             else:
                 data = amazon_s3.getJumpbridgeData(self.dotlan.region.lower())
             self.dotlan.setJumpbridges(data)
-            self.cache.putIntoCache("jumpbridge_url", url, 60 * 60 * 24 * 365 * 8)
+            self.cache.putIntoCacheDeferred("jumpbridge_url", url, 60 * 60 * 24 * 365 * 8)
         except Exception as e:
             QtGui.QMessageBox.warning(None, "Loading jumpbridges failed!", "Error: {0}".format(six.text_type(e)), "OK")
 
@@ -561,7 +617,7 @@ class MainWindow(QtGui.QMainWindow):
             menuAction.setChecked(True)
             regionName = six.text_type(menuAction.property("regionName").toString())
             regionName = dotlan.convertRegionName(regionName)
-            Cache().putIntoCache("region_name", regionName, 60 * 60 * 24 * 365)
+            Cache().putIntoCacheDeferred("region_name", regionName, 60 * 60 * 24 * 365)
             self.setupMap()
 
     def showRegionChooser(self):
@@ -634,9 +690,13 @@ class MainWindow(QtGui.QMainWindow):
         self.trayIcon.setIcon(self.taskbarIconQuiescent)
 
     def changedRoomnames(self, newRoomnames):
-        self.cache.putIntoCache("room_names", u",".join(newRoomnames), 60 * 60 * 24 * 365 * 5)
+        self.cache.putIntoCacheDeferred("room_names", u",".join(newRoomnames), 60 * 60 * 24 * 365 * 5)
         self.chatparser.rooms = newRoomnames
 
+    def logStatistics(self):
+        self.cache.logStatistics(logging.CRITICAL)
+        httpclient.client().logMetrics(logging.CRITICAL)
+
     def showInfo(self):
         infoDialog = QtGui.QDialog(self)
         uic.loadUi(resourcePath("vi/ui/Info.ui"), infoDialog)
@@ -675,25 +735,59 @@ class MainWindow(QtGui.QMainWindow):
         if not self.statisticsButton.isChecked():
             return
         if data["result"] == "ok":
-            self.dotlan.addSystemStatistics(data["statistics"])
+            changed = self.dotlan.addSystemStatistics(data["statistics"])
+            if changed.intersection(self.dotlan.visibleSystems):
+                self.updateMapView()
         elif data["result"] == "error":
             text = data["text"]
             self.trayIcon.showMessage("Loading statstics failed", text, 3)
             logging.error("updateStatisticsOnMap, error: %s" % text)
 
+    def updateMapViewport(self):
+        """
+            Tells the map which part of it is on screen, so only those systems are updated
+            per tick. Returns the systems which came into view.
+        """
+        if self.useNativeMapRenderer:
+            rect = self.nativeMapView.visibleMapRect()
+        else:
+            # The web view is only asked when it is re-rendered, scrolled in systems catch up on the next tick
+            position = self.mapView.page().mainFrame().scrollPosition()
+            size = self.mapView.size()
+            rect = self.dotlan.mapRectFromPage(position.x(), position.y(), size.width(), size.height(),
+                                               self.mapView.zoomFactor())
+        return self.dotlan.setViewport(rect, self.mapView.zoomFactor())
+
+    def nativeMapScrolled(self, value=None):
+        if self.useNativeMapRenderer and self.mapRenderer and self.updateMapViewport():
+            self.mapRenderer.update()
+
     def updateMapView(self):
         logging.debug("Updating map start")
-        self.setMapContent(self.dotlan.svg)
+        self.updateMapViewport()
+        if self.useNativeMapRenderer:
+            self.mapRenderer.update()
+        else:
+            # Stopwatches and the marker are animated by the page, re-render only on changes
+            self.dotlan.update()
+            if self.dotlan.hasChanges():
+                self.setMapContent(self.dotlan.serialize())
         logging.debug("Updating map complete")
 
     def zoomMapIn(self):
         self.mapView.setZoomFactor(self.mapView.zoomFactor() + 0.1)
+        self.nativeMapView.setZoomFactor(self.mapView.zoomFactor())
+        self.updateMapView()
 
     def zoomMapOut(self):
         self.mapView.setZoomFactor(self.mapView.zoomFactor() - 0.1)
+        self.nativeMapView.setZoomFactor(self.mapView.zoomFactor())
+        self.updateMapView()
 
     def logFileChanged(self, path):
         messages = self.chatparser.fileModified(path)
+        self.prefetchThread.addPosters(message.user for message in messages
+                                       if message.status not in (states.LOCATION, states.KOS_STATUS_REQUEST, states.IGNORE))
         for message in messages:
             # If players location has changed
             if message.status == states.LOCATION:
@@ -705,9 +799,10 @@ class MainWindow(QtGui.QMainWindow):
                 if not message.room in self.roomnames:
                     text = message.message[4:]
                     text = text.replace("  ", ",")
-                    parts = (name.strip() for name in text.split(","))
+                    parts = tuple(name.strip() for name in text.split(","))
                     self.trayIcon.setIcon(self.taskbarIconWorking)
                     self.kosRequestThread.addRequest(parts, "xxx", False)
+                    self.prefetchThread.addKosNames(parts)
             # Otherwise consider it a 'normal' chat message
             elif message.user not in ("EVE-System", "EVE System") and message.status != states.IGNORE:
                 self.addMessageToIntelChat(message)
@@ -724,7 +819,7 @@ class MainWindow(QtGui.QMainWindow):
                                 chars = nSystem.getLocatedCharacters()
                                 if len(chars) > 0 and message.user not in chars:
                                     self.trayIcon.showNotification(message, system.name, ", ".join(chars), distance)
-                self.setMapContent(self.dotlan.svg)
+                self.updateMapView()
 
 
 class ChatroomsChooser(QtGui.QDialog):
@@ -769,7 +864,7 @@ class RegionChooser(QtGui.QDialog):
         correct = False
         try:
             url = dotlan.Map.DOTLAN_BASIC_URL.format(text)
-            content = requests.get(url).text
+            content = httpclient.get(url).text
             if u"not found" in content:
                 correct = False
                 # Fallback -> ships vintel with this map?
@@ -788,7 +883,7 @@ class RegionChooser(QtGui.QDialog):
             logging.error(e)
             correct = False
         if correct:
-            Cache().putIntoCache("region_name", text, 60 * 60 * 24 * 365)
+            Cache().putIntoCacheDeferred("region_name", text, 60 * 60 * 24 * 365)
             self.accept()
             self.emit(Qt.SIGNAL("new_region_chosen"))
 
@@ -926,7 +1021,7 @@ class JumpbridgeChooser(QtGui.QDialog):
         try:
             url = six.text_type(self.urlField.text())
             if url != "":
-                requests.get(url).text
+                httpclient.get(url).text
             self.emit(QtCore.SIGNAL("set_jumpbridge_url"), url)
             self.accept()
         except Exception as e: